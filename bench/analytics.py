@@ -0,0 +1,61 @@
+"""
+Time of the vote analytics on synthetic votes.
+
+    python -m bench.analytics
+    python -m bench.analytics --votes 1000000 --voters 500 --categories 5000 --budget 1
+
+Exits with an error when encoding the votes and computing everything takes more than
+`--budget` seconds.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.seed import VOTES  # noqa: E402
+from src.analytics import VoteMatrix  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--votes", type=int, default=1000000)
+    parser.add_argument("--voters", type=int, default=500)
+    parser.add_argument("--categories", type=int, default=5000)
+    parser.add_argument("--budget", type=float, default=1.0, help="max seconds for encoding, scores, voters, agreement and intervals")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    emails = np.array([f"voter{v}@example.com" for v in range(args.voters)], dtype=object)[rng.integers(0, args.voters, args.votes)]
+    category_ids = np.array([f"s{s}" for s in range(args.categories)], dtype=object)[rng.integers(0, args.categories, args.votes)]
+    votes = np.array(VOTES, dtype=object)[rng.integers(0, len(VOTES), args.votes)]
+
+    timings = {}
+
+    def timed(name, fn, *fn_args):
+        start = time.perf_counter()
+        result = fn(*fn_args)
+        timings[name] = round(time.perf_counter() - start, 4)
+        return result
+
+    matrix = timed("encode", VoteMatrix.from_arrays, emails.tolist(), category_ids.tolist(), votes.tolist())
+    timed("scores", matrix.scores)
+    timed("voter_stats", matrix.voter_stats)
+    timed("agreement", matrix.agreement)
+    timed("bootstrap", matrix.bootstrap)
+
+    # encoding runs on every scoreboard change as well, it is part of the cost
+    computed = sum(timings.values())
+    print(json.dumps({"votes": args.votes, "voters": args.voters, "categories": args.categories, "seconds": timings, "computed": round(computed, 4)}, indent=2))
+
+    if computed > args.budget:
+        sys.exit(f"Analytics took {computed:.2f}s, over the budget of {args.budget}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Time to first render: the first visitor of a freshly started server, with and without the
+warmup (src/warmup.py) run before it.
+
+    python -m bench.first_render
+    python -m bench.first_render --products 10000 --image-latency 0.2 --budget 3
+
+Every mode runs in its own interpreter, so imports and process caches start cold. Images
+come from a fake source answering after `--image-latency` seconds. Exits with an error when
+the warmed-up first render takes more than `--budget` seconds, or shows a thumbnail the
+warmup did not cache.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def first_render(args) -> dict:
+    start = time.perf_counter()
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    from src import gallery, utils
+    imports = time.perf_counter() - start
+
+    from bench.run import fake_image
+    from bench.seed import seed
+    from src import db, warmup
+
+    def fetcher(url: str) -> bytes:
+        time.sleep(args.image_latency)
+        return fake_image(url)
+
+    tmp_dir = tempfile.mkdtemp(prefix="voting-first-render-")
+    try:
+        # the app connects to the same in-memory database through its secrets
+        database = db.connect({"MONGO_URL": "mongomock://bench", "MONGO_DB_NAME": "voting_bench"})
+        seed(database, n_products=args.products, n_voters=args.voters)
+
+        thumbnail_dir = os.path.join(tmp_dir, "thumbnails")
+        warmup_stats = None
+        if args.mode == "warm":
+            warmup_cache = gallery.ThumbnailCache(thumbnail_dir, fetcher=fetcher)
+            warmup_stats = warmup.warmup(database, warmup_cache)
+            warmup_cache.close()
+
+        # the app has a thumbnail cache of its own, on the same directory
+        thumbnails = gallery.ThumbnailCache(thumbnail_dir, fetcher=fetcher)
+        utils.get_thumbnail_cache = lambda: thumbnails
+        st.cache_resource.clear()
+
+        # images the first render had to send as remote urls, the warmup is there to avoid them
+        misses = []
+        cached_get = thumbnails.get
+
+        def counted_get(url: str, wait: bool = True):
+            data = cached_get(url, wait)
+            if data is None:
+                misses.append(url)
+            return data
+
+        thumbnails.get = counted_get
+
+        at = AppTest.from_file(os.path.join(ROOT, "voting_app.py"), default_timeout=300)
+        at.secrets["MONGO_URL"] = "mongomock://bench"
+        at.secrets["MONGO_DB_NAME"] = "voting_bench"
+        at.secrets["password"] = "bench"
+        at.secrets["companyDomain"] = "example.com"
+        at.session_state["password_correct"] = True
+        # a first visit: the seeded voters would each start on a page of their own
+        at.session_state["user_email"] = "newcomer@example.com"
+
+        start = time.perf_counter()
+        at.run()
+        first_run = time.perf_counter() - start
+        first_run_misses = len(misses)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+        start = time.perf_counter()
+        at.run()
+        second_run = time.perf_counter() - start
+        thumbnails.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        "mode": args.mode,
+        "imports_s": round(imports, 3),
+        "first_render_s": round(first_run, 3),
+        "second_render_s": round(second_run, 3),
+        "time_to_first_render_s": round(imports + first_run, 3),
+        "thumbnail_misses": first_run_misses,
+        "warmup": warmup_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--voters", type=int, default=10)
+    parser.add_argument("--image-latency", type=float, default=0.1, help="seconds the fake image source takes per image")
+    parser.add_argument("--budget", type=float, default=5, help="max seconds to the first render after a warmup")
+    parser.add_argument("--mode", choices=["cold", "warm"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(RESULT_PREFIX + json.dumps(first_render(args)))
+        return
+
+    reports = []
+    for mode in ("cold", "warm"):
+        cmd = [sys.executable, "-m", "bench.first_render", "--mode", mode, "--products", str(args.products),
+               "--voters", str(args.voters), "--image-latency", str(args.image_latency)]
+        env = {**os.environ, "DEBUG": "false"}
+        out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, env=env)
+        if out.returncode != 0:
+            sys.exit(f"First render ({mode}) failed:\n{out.stderr}")
+        result = next(line for line in out.stdout.splitlines() if line.startswith(RESULT_PREFIX))
+        reports.append(json.loads(result[len(RESULT_PREFIX):]))
+
+    print(json.dumps({"products": args.products, "voters": args.voters, "image_latency": args.image_latency, "runs": reports}, indent=2))
+
+    warm = reports[1]
+    if warm["time_to_first_render_s"] > args.budget:
+        sys.exit(f"Time to first render after the warmup is {warm['time_to_first_render_s']}s, over the budget of {args.budget}s")
+    if warm["thumbnail_misses"]:
+        sys.exit(f"{warm['thumbnail_misses']} thumbnails of the first render were not cached by the warmup")
+
+
+if __name__ == "__main__":
+    main()
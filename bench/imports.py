@@ -0,0 +1,76 @@
+"""
+Import time of the app modules, from `python -X importtime`.
+
+    python -m bench.imports
+    python -m bench.imports --modules src.utils src.warmup --budget-ms 800 --repeat 5
+
+Every module is imported in a fresh interpreter, `--repeat` times (the best run counts, the
+first one also compiles the .pyc files). Exits with an error when a module takes more than
+`--budget-ms`, or when it pulls one of the heavy modules the app only needs on some pages.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["src.utils", "src.warmup"]
+
+# analytics, exports, snapshots, plots and image resizing import them when they run
+DEFERRED = ["numpy", "scipy", "pyarrow", "pandas", "matplotlib", "PIL"]
+
+
+def import_times(module: str) -> dict:
+    """Cumulative microseconds per imported module, parsed from the -X importtime report."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{out.stderr}")
+
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+def measure(module: str, repeat: int) -> dict:
+    runs = [import_times(module) for _ in range(repeat)]
+    best = min(runs, key=lambda times: times[module])
+
+    # top level packages only, their cumulative time already covers the submodules
+    packages = {}
+    for name, us in best.items():
+        package = name.split(".")[0]
+        if package != module.split(".")[0]:
+            packages[package] = max(packages.get(package, 0), us)
+
+    return {
+        "module": module,
+        "import_ms": round(best[module] / 1000, 1),
+        "heaviest_ms": {name: round(us / 1000, 1) for name, us in sorted(packages.items(), key=lambda x: -x[1])[:10]},
+        "deferred_imported": sorted({name.split(".")[0] for name in best} & set(DEFERRED)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="max import time of every module")
+    args = parser.parse_args()
+
+    reports = [measure(module, args.repeat) for module in args.modules]
+    print(json.dumps(reports, indent=2))
+
+    errors = [f"{r['module']} takes {r['import_ms']} ms" for r in reports if r["import_ms"] > args.budget_ms]
+    errors += [f"{r['module']} imports {', '.join(r['deferred_imported'])}" for r in reports if r["deferred_imported"]]
+    if errors:
+        sys.exit(f"Over the import budget of {args.budget_ms} ms: " + "; ".join(errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Benchmark and load test of the voting flow against a local MongoDB stand-in.
+
+    python -m bench.run                                  # mongomock, default scales
+    python -m bench.run --products 1000 10000 100000 --voters 10 100 500
+    python -m bench.run --mongod mongod                  # real mongod started in a temp dir
+    python -m bench.run --mongod mongod --replica-set    # same, as a single-node replica set (change streams)
+    python -m bench.run --output bench_output.json
+
+Every (products, voters) scale runs in its own process so that the peak RSS is meaningful.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.seed import VOTES, seed  # noqa: E402
+
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+MONGOMOCK_METHODS = [
+    "find", "find_one", "aggregate", "insert_one", "insert_many", "update_one", "update_many",
+    "delete_one", "delete_many", "bulk_write", "count_documents", "estimated_document_count",
+    "create_index", "distinct", "find_one_and_update",
+]
+
+
+class RoundTrips:
+    """Counts the commands sent to the database, per command name."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def patch_mongomock(self):
+        import mongomock
+
+        for name in MONGOMOCK_METHODS:
+            original = getattr(mongomock.collection.Collection, name)
+
+            def counted(*args, _original=original, _name=name, **kwargs):
+                self.add(_name)
+                return _original(*args, **kwargs)
+
+            setattr(mongomock.collection.Collection, name, counted)
+
+    def listener(self):
+        from pymongo import monitoring
+
+        counter = self
+
+        class Listener(monitoring.CommandListener):
+            def started(self, event):
+                if event.command_name not in ("hello", "isMaster", "ping", "endSessions"):
+                    counter.add(event.command_name)
+
+            def succeeded(self, event):
+                pass
+
+            def failed(self, event):
+                pass
+
+        return Listener()
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {"n": len(ordered), "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99), "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+class Recorder:
+    def __init__(self, round_trips: RoundTrips):
+        self.round_trips = round_trips
+        self.latencies = defaultdict(list)
+        self.trips = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def measure(self, name: str, fn, *args, **kwargs):
+        trips_before = self.round_trips.total
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            # only exact when the action runs alone, concurrent app runs report an upper bound
+            self.trips[name].append(self.round_trips.total - trips_before)
+        return result
+
+    def report(self) -> dict:
+        return {
+            name: {
+                **percentiles(samples),
+                "round_trips_per_action": round(sum(self.trips[name]) / len(self.trips[name]), 2),
+            }
+            for name, samples in self.latencies.items()
+        }
+
+
+def fake_image(url: str) -> bytes:
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (800, 800), (hash(url) % 255, 120, 60)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def start_mongod(binary: str, directory: str, replica_set: bool = False):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    cmd = [binary, "--dbpath", directory, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"]
+    if replica_set:
+        cmd += ["--replSet", "bench"]
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f"mongodb://127.0.0.1:{port}/?directConnection=true"
+    if replica_set:
+        from pymongo import MongoClient
+
+        # single-node replica set, the only way to get change streams locally
+        admin = MongoClient(url, serverSelectionTimeoutMS=30000).admin
+        admin.command("replSetInitiate", {"_id": "bench", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]})
+        while not admin.command("hello").get("isWritablePrimary"):
+            time.sleep(0.1)
+    return process, url
+
+
+def live_results_lag(db, writer, email: str, i: int, timeout: float = 30) -> tuple:
+    """Mode of the live results watcher, and seconds between a vote written and the scoreboard showing it."""
+    from src import live_results
+
+    live = live_results.LiveResults(db, poll_interval=0.1)
+    try:
+        live.wait_ready(timeout)
+        version = live.scoreboard.version
+        start = time.perf_counter()
+        writer.write([{"email": email, "categoryId": f"live{i}", "name": f"Live {i}", "vote": VOTES[0]}])
+        while live.scoreboard.version == version and time.perf_counter() - start < timeout:
+            time.sleep(0.005)
+        return live.mode, time.perf_counter() - start
+    finally:
+        live.close()
+
+
+def run_scale(args) -> dict:
+    import streamlit as st
+    from src import db as mongo, gallery, progress, results, utils
+    from src.catalog import Catalog
+    from src.vote_writer import VoteWriter
+
+    round_trips = RoundTrips()
+    tmp_dir = tempfile.mkdtemp(prefix="voting-bench-")
+    mongod = None
+    thumbnails = None
+
+    try:
+        if args.mongod:
+            from pymongo import MongoClient
+
+            mongod, url = start_mongod(args.mongod, tmp_dir, args.replica_set)
+            client = MongoClient(url, event_listeners=[round_trips.listener()], serverSelectionTimeoutMS=30000)
+        else:
+            import mongomock
+
+            round_trips.patch_mongomock()
+            client = mongomock.MongoClient()
+
+        db = client["voting_bench"]
+        scale = seed(db, n_products=args.products[0], n_voters=args.voters[0], votes_per_voter=args.voted_fraction)
+
+        # every piece of the app talks to the stand-in, images come from a fake source
+        mongo.MongoClient = lambda *a, **k: client
+        thumbnails = gallery.ThumbnailCache(os.path.join(tmp_dir, "thumbnails"), fetcher=fake_image)
+        utils.get_thumbnail_cache = lambda: thumbnails
+        st.cache_resource.clear()
+
+        recorder = Recorder(round_trips)
+        emails = [f"voter{v}@example.com" for v in range(args.voters[0])]
+
+        recorder.measure("catalog_cold_build", Catalog(db).refresh, True)
+        recorder.measure("ensure_indexes", progress.ensure_indexes, db)
+        recorder.measure("ensure_results", results.ensure_results, db)
+
+        for email in emails[:args.samples]:
+            st.session_state["user_email"] = email
+            st.session_state.pop("progress", None)
+            recorder.measure("get_data", utils.get_data, db)
+
+        for _ in range(args.samples):
+            recorder.measure("get_results", utils.get_results, db)
+
+        writer = VoteWriter(db, spool_path=None)
+        for i in range(args.samples):
+            vote = {"email": emails[i % len(emails)], "categoryId": f"s{i}", "name": f"Sub category {i}", "vote": VOTES[i % 3]}
+            recorder.measure("vote_write_window", writer.write, [vote])
+            recorder.measure("vote_submit", writer.submit, vote)
+        writer.flush(30)
+
+        live_mode = None
+        for i in range(args.samples):
+            live_mode, lag = live_results_lag(db, writer, emails[0], i)
+            recorder.latencies["live_results_lag"].append(lag)
+            recorder.trips["live_results_lag"].append(0)
+        writer.close()
+
+        run_app(args, recorder, emails)
+
+        return {
+            "scale": scale,
+            "backend": "mongod" if args.mongod else "mongomock",
+            "live_results": live_mode,
+            "results": recorder.report(),
+            "round_trips_by_command": dict(round_trips.counts),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+    finally:
+        if thumbnails is not None:
+            thumbnails.close()
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def run_app(args, recorder: Recorder, emails: list):
+    from streamlit.testing.v1 import AppTest
+
+    def voter(email: str):
+        at = AppTest.from_file(os.path.join(ROOT, "voting_app.py"), default_timeout=120)
+        at.secrets["MONGO_URL"] = "mongodb://bench"
+        at.secrets["MONGO_DB_NAME"] = "voting_bench"
+        at.secrets["password"] = "bench"
+        at.secrets["companyDomain"] = "example.com"
+        at.session_state["password_correct"] = True
+        at.session_state["user_email"] = email
+
+        recorder.measure("app_first_run", at.run)
+        for _ in range(args.app_votes):
+            if at.exception or not at.button:
+                break
+            recorder.measure("app_vote", at.button[0].click().run)
+
+        if at.exception:
+            print(f"App exception for {email}: {at.exception[0].message}", file=sys.stderr)
+
+    os.environ.pop("DEBUG", None)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(voter, emails[:args.app_voters]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--voters", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--voted-fraction", type=float, default=0.5, help="fraction of the catalog each voter already voted")
+    parser.add_argument("--samples", type=int, default=20, help="repetitions of every timed action")
+    parser.add_argument("--app-voters", type=int, default=10, help="simulated voters driving voting_app.py")
+    parser.add_argument("--app-votes", type=int, default=5, help="votes cast by each simulated voter")
+    parser.add_argument("--concurrency", type=int, default=4, help="simulated voters running at the same time")
+    parser.add_argument("--mongod", default=None, help="path of a mongod binary to use instead of mongomock")
+    parser.add_argument("--replica-set", action="store_true", help="start mongod as a single-node replica set")
+    parser.add_argument("--output", default=None, help="write the JSON report here as well")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(RESULT_PREFIX + json.dumps(run_scale(args)))
+        return
+
+    reports = []
+    for n_products in args.products:
+        for n_voters in args.voters:
+            cmd = [sys.executable, "-m", "bench.run", "--single", "--products", str(n_products), "--voters", str(n_voters)]
+            for flag in ("voted_fraction", "samples", "app_voters", "app_votes", "concurrency", "mongod"):
+                value = getattr(args, flag)
+                if value is not None:
+                    cmd += [f"--{flag.replace('_', '-')}", str(value)]
+            if args.replica_set:
+                cmd.append("--replica-set")
+
+            print(f"Running {n_products} products / {n_voters} voters...", file=sys.stderr)
+            out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+            if out.returncode != 0:
+                print(out.stderr, file=sys.stderr)
+                continue
+            result = next(line for line in out.stdout.splitlines() if line.startswith(RESULT_PREFIX))
+            reports.append(json.loads(result[len(RESULT_PREFIX):]))
+
+    report = json.dumps({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": reports}, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Simulated voting campaign, catalog order against the adaptive scheduler.
+
+    python -m bench.scheduler
+    python -m bench.scheduler --categories 1000 --voters 20 --confidence 0.9 0.95 0.99
+
+Every category gets a hidden label mix; a voter's vote on a category is drawn once and is
+the same in every mode. The reference status is the one reached when everybody votes on
+everything. Reports, per mode, the votes cast when the campaign ends and the share of the
+categories whose status matches the reference at that point (and the votes needed to
+first reach 95% and 99% of them).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.seed import VOTES  # noqa: E402
+from src import scoring  # noqa: E402
+from src.catalog import Catalog, CatalogSnapshot  # noqa: E402
+from src.live_results import Scoreboard  # noqa: E402
+from src.progress import VoterProgress  # noqa: E402
+from src.scheduler import Scheduler  # noqa: E402
+
+
+def campaign(n_categories: int, n_voters: int, n_macro_categories: int = 20, seed: int = 42) -> tuple:
+    rng = random.Random(seed)
+    docs = {}
+    mixes = {}
+    for s in range(n_categories):
+        macro_id = f"m{s % n_macro_categories}"
+        docs.setdefault(macro_id, {"_id": macro_id, "name": f"Macro category {macro_id}", "sub_categories": []})
+        docs[macro_id]["sub_categories"].append({"categoryId": f"s{s}", "name": f"Sub category {s}", "parentCateId": macro_id})
+        # most categories lean clearly one way, some are genuinely split
+        mixes[f"s{s}"] = [rng.random() ** 2 for _ in VOTES]
+
+    voters = [f"voter{v}@example.com" for v in range(n_voters)]
+    ballots = {
+        (email, category_id): rng.choices(VOTES, weights=mix)[0]
+        for category_id, mix in mixes.items()
+        for email in voters
+    }
+    return list(docs.values()), voters, ballots
+
+
+def reference_statuses(ballots: dict) -> dict:
+    scores = {}
+    for (_, category_id), vote in ballots.items():
+        scores[category_id] = scores.get(category_id, 0) + scoring.DEFAULT_SCORING.weight(vote)
+    return {category_id: scoring.DEFAULT_SCORING.status(score) for category_id, score in scores.items()}
+
+
+def accuracy(scoreboard: Scoreboard, reference: dict) -> float:
+    statuses = {row["categoryId"]: scoring.DEFAULT_SCORING.status(row["score"]) for row in scoreboard.rows()}
+    return sum(statuses.get(category_id, scoring.CONFUSED) == status for category_id, status in reference.items()) / len(reference)
+
+
+def simulate(docs: list, voters: list, ballots: dict, reference: dict, confidence: float = None,
+             check_every: int = 100, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    catalog = Catalog(None)
+    catalog.snapshot = CatalogSnapshot(1, docs)
+    snapshot = catalog.snapshot
+
+    scoreboard = Scoreboard()
+    progress = {email: VoterProgress(email, set(), catalog) for email in voters}
+    adaptive = None
+    if confidence is not None:
+        adaptive = Scheduler(confidence=confidence, n_voters=len(voters))
+        adaptive.sync(snapshot, scoreboard)
+
+    cursors = dict.fromkeys(voters, 0)
+    active = list(voters)
+    n_votes = 0
+    reached = {}
+    while active:
+        email = rng.choice(active)
+        if adaptive is not None:
+            sub = adaptive.pick(progress[email])
+        else:
+            # the voter goes through the catalog in its order, as the selectboxes do
+            sub = snapshot.sub_categories[cursors[email]] if cursors[email] < snapshot.size else None
+            cursors[email] += 1
+        if sub is None:
+            active.remove(email)
+            continue
+
+        vote = ballots[(email, sub.categoryId)]
+        progress[email].on_vote(sub.categoryId)
+        scoreboard.apply({"_id": (email, sub.categoryId), "email": email, "categoryId": sub.categoryId, "name": sub.name, "vote": vote})
+        n_votes += 1
+
+        if n_votes % check_every == 0:
+            share = accuracy(scoreboard, reference)
+            for target in (0.95, 0.99):
+                if share >= target:
+                    reached.setdefault(str(target), n_votes)
+
+    return {
+        "mode": "catalog order" if adaptive is None else f"adaptive (confidence {confidence})",
+        "votes": n_votes,
+        "accuracy": round(accuracy(scoreboard, reference), 4),
+        "votes_to_accuracy": reached,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--categories", type=int, default=500)
+    parser.add_argument("--voters", type=int, default=10)
+    parser.add_argument("--confidence", type=float, nargs="+", default=[0.95, 0.99])
+    args = parser.parse_args()
+
+    docs, voters, ballots = campaign(args.categories, args.voters)
+    reference = reference_statuses(ballots)
+
+    runs = [simulate(docs, voters, ballots, reference)]
+    runs += [simulate(docs, voters, ballots, reference, confidence) for confidence in args.confidence]
+    for run in runs[1:]:
+        run["votes_saved"] = f"{1 - run['votes'] / runs[0]['votes']:.1%}"
+
+    print(json.dumps({"categories": args.categories, "voters": args.voters, "runs": runs}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import random
+
+VOTES = ["interesting", "mid interesting", "not interesting"]
+
+
+def seed(db, n_products: int = 1000, n_voters: int = 10, products_per_category: int = 20,
+         n_macro_categories: int = 30, votes_per_voter: float = 0.5, seed: int = 42) -> dict:
+    """
+    Fill `products_for_voting`, `categories` and `category_votes` with synthetic data.
+
+    `votes_per_voter` is the fraction of the sub categories every voter already voted on.
+    """
+    rng = random.Random(seed)
+    n_sub_categories = max(1, n_products // products_per_category)
+
+    categories = [
+        {"categoryId": f"m{m}", "parentCateId": "0", "name": f"Macro category {m}", "importance": rng.randint(0, 10)}
+        for m in range(n_macro_categories)
+    ]
+    categories += [
+        {"categoryId": f"s{s}", "parentCateId": f"m{s % n_macro_categories}", "name": f"Sub category {s}"}
+        for s in range(n_sub_categories)
+    ]
+    db["categories"].insert_many(categories)
+
+    db["products_for_voting"].insert_many([
+        {
+            "categoryId": f"s{rng.randrange(n_sub_categories)}",
+            "id1688": str(rng.randrange(n_products * 2)),
+            "imgUrl": f"https://cbu01.alicdn.com/img/ibank/{p}.jpg",
+            "title": f"Product {p}",
+            "soldOut": rng.randint(0, 10000),
+        }
+        for p in range(n_products)
+    ])
+
+    voters = [f"voter{v}@example.com" for v in range(n_voters)]
+    votes = []
+    for email in voters:
+        for s in rng.sample(range(n_sub_categories), int(n_sub_categories * votes_per_voter)):
+            votes.append({"email": email, "categoryId": f"s{s}", "name": f"Sub category {s}", "vote": rng.choice(VOTES)})
+    if votes:
+        db["category_votes"].insert_many(votes)
+
+    return {
+        "products": n_products,
+        "sub_categories": n_sub_categories,
+        "macro_categories": n_macro_categories,
+        "voters": n_voters,
+        "votes": len(votes),
+    }
@@ -0,0 +1,94 @@
+"""
+Memory kept per browser session by the voting flow, for growing catalogs.
+
+    python -m bench.session_memory
+    python -m bench.session_memory --sub-categories 1000 10000 --sessions 500 --budget 8192
+
+Exits with an error when a session costs more than `--budget` bytes.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.catalog import Catalog, CatalogSnapshot  # noqa: E402
+from src.navigation import Navigator  # noqa: E402
+from src.progress import VoterProgress  # noqa: E402
+
+
+def catalog_docs(n_sub_categories: int, n_macro_categories: int = 30, products_per_category: int = 10) -> list:
+    docs = {}
+    for s in range(n_sub_categories):
+        macro_id = f"m{s % n_macro_categories}"
+        docs.setdefault(macro_id, {"_id": macro_id, "name": f"Macro category {macro_id}", "sub_categories": []})
+        docs[macro_id]["sub_categories"].append({
+            "categoryId": f"s{s}",
+            "name": f"Sub category {s}",
+            "parentCateId": macro_id,
+            "tot": products_per_category,
+            "tot_sales": 0,
+            "products": [
+                {"id1688": f"{s}{p}", "image": f"https://cbu01.alicdn.com/img/ibank/{s}_{p}.jpg", "title": f"Product {s} {p}", "sales": p}
+                for p in range(products_per_category)
+            ],
+        })
+    return list(docs.values())
+
+
+def measure(n_sub_categories: int, n_sessions: int, voted_fraction: float, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    catalog = Catalog(None)
+    catalog.snapshot = CatalogSnapshot(1, catalog_docs(n_sub_categories))
+    catalog_bytes = tracemalloc.get_traced_memory()[0] - before
+
+    category_ids = [sub.categoryId for sub in catalog.snapshot.sub_categories]
+    voted = [set(rng.sample(category_ids, int(len(category_ids) * voted_fraction))) for _ in range(n_sessions)]
+
+    # what utils.get_progress keeps in st.session_state, one per session
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [VoterProgress(f"voter{i}@example.com", voted[i], catalog) for i in range(n_sessions)]
+    session_bytes = (tracemalloc.get_traced_memory()[0] - before) / n_sessions
+
+    # a rerun builds its navigator from the session and drops it at the end
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    navigator = Navigator(sessions[0])
+    navigator.sub_names(0)
+    rerun_peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        "sub_categories": n_sub_categories,
+        "sessions": n_sessions,
+        "catalog_bytes": catalog_bytes,
+        "bytes_per_session": round(session_bytes),
+        "rerun_peak_bytes": rerun_peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sub-categories", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--voted-fraction", type=float, default=0.5)
+    parser.add_argument("--budget", type=int, default=8192, help="max bytes per session")
+    args = parser.parse_args()
+
+    reports = [measure(n, args.sessions, args.voted_fraction) for n in args.sub_categories]
+    print(json.dumps(reports, indent=2))
+
+    over = [r for r in reports if r["bytes_per_session"] > args.budget]
+    if over:
+        sys.exit(f"{len(over)} catalog sizes over the budget of {args.budget} bytes per session")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,105 @@
-from pymongo import MongoClient
+import argparse
+from collections import Counter
 
-from src import utils
+from src import classification, db, results, scoring
 
-with open(".streamlit/secrets.toml") as f:
-    toml_data = f.read()
-
-MONGO_URL = toml_data.split("MONGO_URL = ")[1].split("\n")[0].replace('"', "").strip()
-MONGO_DB_NAME = toml_data.split("MONGO_DB_NAME = ")[1].split("\n")[0].replace('"', "").strip()
-
-client = MongoClient(MONGO_URL)[MONGO_DB_NAME]
+client = db.connect()
 
 if __name__ == "__main__":
 
-    votes = utils.get_results(client)
-    print(f"\nCollected {sum([doc["total_votes"] for doc in votes])} votes on a total of {len(list(votes))} categories")
+    parser = argparse.ArgumentParser(description="Classify the categories from the votes and clean up the rejected products")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    parser.add_argument("--chunk-size", type=int, default=500, help="operations per bulk write")
+    parser.add_argument("--rate", type=float, default=None, help="max write operations per second")
+    parser.add_argument("--snapshot", default=None, help="read the votes from this snapshot (scripts/snapshot.py) instead of the database")
+    parser.add_argument("--analytics", action="store_true", help="also report the agreement between voters, their bias and the score intervals")
+    args = parser.parse_args()
+
+    votes_snapshot = None
+    if args.snapshot:
+        # pyarrow only when reading a snapshot
+        from src import snapshot
+        votes_snapshot = snapshot.Snapshot(args.snapshot)
+    # recomputed from the votes themselves, the materialized counters may be missing or drifted
+    votes = votes_snapshot.get_scores() if votes_snapshot else results.get_raw_scores(client)
+    print(f"\nCollected {sum([doc['total_votes'] for doc in votes])} votes on a total of {len(votes)} categories")
 
     print("\nTop 5 categories by score:")
-    for i, vote in enumerate(list(votes)[:5]):
+    for i, vote in enumerate(votes[:5]):
         print(f"{i + 1}. {vote['categoryId']} - {vote['name']} - score = {vote['score']}")
 
     # set the categories with score >= 1 as "confirmed interesting",
     # and the ones with score < 0 as "confirmed not interesting"
     # and the ones in between as "confused"
 
-    confirmed_interesting, confirmed_not_interesting, confused = [], [], []
-
-    for vote in votes:
-        if vote["score"] >= 1:
-            confirmed_interesting.append(str(vote["categoryId"]))
-        elif vote["score"] < 0:
-            confirmed_not_interesting.append(str(vote["categoryId"]))
-        else:
-            confused.append(str(vote["categoryId"]))
-
-    print("\nConfirmed interesting categories:", len(confirmed_interesting))
-    print("Confirmed not interesting categories:", len(confirmed_not_interesting))
-    print("Confused categories:", len(confused))
-
-    # exit(0)
-
-    # first, unset the confirmation_status field for all categories
-    client["categories"].update_many(
-        {"confirmation_status": {"$exists": True}},
-        {"$unset": {"confirmation_status": ""}}
-    )
-
-    res = client["categories"].update_many(
-        {"categoryId": {"$in": confirmed_interesting}}, 
-        {"$set": {"confirmation_status": 1}}
-    )
-    print("Updated", res.modified_count, "categories as confirmed interesting")
-    res = client["categories"].update_many(
-        {"categoryId": {"$in": confirmed_not_interesting}}, 
-        {"$set": {"confirmation_status": -1}}
-    )
-    print("Updated", res.modified_count, "categories as confirmed not interesting")
-    res = client["categories"].update_many(
-        {"categoryId": {"$in": confused}}, 
-        {"$set": {"confirmation_status": 0}}
-    )
-    print("Updated", res.modified_count, "categories as confused")
+    desired = classification.desired_statuses(votes)
+    totals = Counter(desired.values())
+
+    print("\nConfirmed interesting categories:", totals[scoring.CONFIRMED])
+    print("Confirmed not interesting categories:", totals[scoring.REJECTED])
+    print("Confused categories:", totals[scoring.CONFUSED])
+
+    # only write the categories whose status actually changed
+    # a dry run on a snapshot never touches the database, a real run diffs against the live statuses
+    current = votes_snapshot.statuses() if votes_snapshot and args.dry_run else classification.current_statuses(client)
+    changes = classification.diff(desired, current)
+    if not desired and changes:
+        # no scores at all is an empty or unreachable votes collection, never a reason to unset everything
+        print(f"\nNo category has votes, refusing to unset the status of {len(changes)} categories")
+        changes = []
+    changed = Counter(new for _, _, new in changes)
+
+    print(f"\n{'Would update' if args.dry_run else 'Updating'} {len(changes)} categories:")
+    print("\tto confirmed interesting:", changed[scoring.CONFIRMED])
+    print("\tto confirmed not interesting:", changed[scoring.REJECTED])
+    print("\tto confused:", changed[scoring.CONFUSED])
+    print("\tunset:", changed[None])
+
+    res = classification.apply_statuses(client, changes, chunk_size=args.chunk_size, max_per_second=args.rate, dry_run=args.dry_run)
+    if not args.dry_run:
+        print("Updated", res, "categories")
 
     # make an histogram of the votes
-    import matplotlib.pyplot as plt
     all_votes = [vote["score"] for vote in votes]
 
-    plt.title("Histogram of categories scores")
-    plt.hist(all_votes, bins=range(int(min(all_votes)) - 1, int(max(all_votes)) + 2, 1), alpha=0.75)
-    plt.xticks(range(int(min(all_votes)) - 1, int(max(all_votes)) + 2, 1))
-    plt.xlabel("Score")
-    plt.ylabel("Number of categories")
-    plt.grid(True)
-    plt.savefig("scripts/categories_scores.png")
+    if all_votes:
+        import matplotlib.pyplot as plt
+        plt.title("Histogram of categories scores")
+        plt.hist(all_votes, bins=range(int(min(all_votes)) - 1, int(max(all_votes)) + 2, 1), alpha=0.75)
+        plt.xticks(range(int(min(all_votes)) - 1, int(max(all_votes)) + 2, 1))
+        plt.xlabel("Score")
+        plt.ylabel("Number of categories")
+        plt.grid(True)
+        plt.savefig("scripts/categories_scores.png")
 
     print("\nConfused categories:")
-    for categoryId in confused:
-        # find back the name by iteraing over the votes
-        for vote in votes:
-            if vote["categoryId"] == categoryId:
-                print(f"\t{categoryId}\t{vote['name']}")
-                break
+    names = {vote["categoryId"]: vote["name"] for vote in votes}
+    for categoryId, status in desired.items():
+        if status == scoring.CONFUSED:
+            print(f"\t{categoryId}\t{names[categoryId]}")
+
+    if args.analytics:
+        from src import analytics
+        matrix = analytics.VoteMatrix.from_snapshot(votes_snapshot) if votes_snapshot else analytics.VoteMatrix.load(client)
+        agreement = matrix.agreement()
+        print(f"\nAgreement on {matrix.n_votes} votes: Fleiss' kappa = {agreement['fleiss_kappa']}, Krippendorff's alpha = {agreement['krippendorff_alpha']}")
+
+        print("\nVoters by bias (mean distance from the other votes on the same categories):")
+        for voter, stats in sorted(matrix.voter_stats().items(), key=lambda x: -abs(x[1]["bias"])):
+            print(f"\t{voter}\t{stats['votes']} votes\tleniency = {stats['leniency']}\tbias = {stats['bias']}")
+
+        # a confused category whose interval crosses a threshold may just need more votes
+        low, high = matrix.bootstrap()
+        positions = {category_id: i for i, category_id in enumerate(matrix.category_ids)}
+        print("\nConfused categories score intervals (95% bootstrap):")
+        for categoryId, status in desired.items():
+            if status == scoring.CONFUSED and categoryId in positions:
+                i = positions[categoryId]
+                print(f"\t{categoryId}\t[{low[i]:.2f}, {high[i]:.2f}]\tagreement = {agreement['per_category'].get(categoryId, {}).get('agreement')}")
 
     # erase all products from hot1688_winning_products that are in the confirmed non-interesting categories
-    res = client["hot1688_winning_products"].delete_many(
-        {"categoryId": {"$in": confirmed_not_interesting}}
+    confirmed_not_interesting = [categoryId for categoryId, status in desired.items() if status == scoring.REJECTED]
+    res = classification.delete_products(
+        client, confirmed_not_interesting, chunk_size=args.chunk_size, max_per_second=args.rate, dry_run=args.dry_run
     )
-    print("\nDeleted", res.deleted_count, "products from the confirmed not interesting categories")
+    print(f"\n{'Would delete' if args.dry_run else 'Deleted'}", res, "products from the confirmed not interesting categories")
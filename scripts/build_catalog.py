@@ -0,0 +1,21 @@
+import argparse
+
+from src import catalog_builder, db
+
+client = db.connect()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Materialize the voting catalog, one document per macro category. Meant to run "
+                                                 "on a schedule: a run only recomputes the sub categories with new products, "
+                                                 "and rebuilds everything when the last full build is older than --full-every hours, "
+                                                 "which is when changed sales, deleted products and renamed categories show up")
+    parser.add_argument("--full", action="store_true", help="rebuild every category instead of only the ones with new products")
+    parser.add_argument("--full-every", type=float, default=catalog_builder.FULL_BUILD_EVERY / 3600, help="hours between two full builds")
+    parser.add_argument("--limit", type=int, default=catalog_builder.PRODUCTS_PER_CATEGORY, help="products kept per sub category")
+    args = parser.parse_args()
+
+    stats = catalog_builder.build(client, full=args.full, limit=args.limit, full_every=args.full_every * 3600)
+
+    print(f"{'Full build' if stats['full'] else 'Incremental build'}: updated {stats['changed_sub_categories']} sub categories in {stats['changed_macro_categories']} macro categories")
+    print(f"Catalog version: {stats['version']}")
@@ -1,78 +1,72 @@
-from pymongo import MongoClient
+import argparse
+import json
 
-with open(".streamlit/secrets.toml") as f:
-    toml_data = f.read()
+from src import audit, db, results
 
-MONGO_URL = toml_data.split("MONGO_URL = ")[1].split("\n")[0].replace('"', "").strip()
-MONGO_DB_NAME = toml_data.split("MONGO_DB_NAME = ")[1].split("\n")[0].replace('"', "").strip()
-
-client = MongoClient(MONGO_URL)[MONGO_DB_NAME]
-
-email_1 = toml_data.split("EMAIL = ")[1].split("\n")[0].replace('"', "").strip()
-email_2 = toml_data.split("EMAIL_2 = ")[1].split("\n")[0].replace('"', "").strip()
+config = db.load_config()
+client = db.connect(config)
 
 if __name__ == "__main__":
 
-    votes_1 = client["category_votes"].find({"email": email_1})
-    votes_2 = client["category_votes"].find({"email": email_2})
-
-    # check which categories are voted by 1 but not by 2
-    categories_1 = set([vote["categoryId"] for vote in votes_1])
-    categories_2 = set([vote["categoryId"] for vote in votes_2])
-
-    missing_votes = categories_1.difference(categories_2)
-
-    print(len(categories_1), len(categories_2), len(missing_votes))
-
-    print("\nCategories voted by 1 but not by 2:")
-    for i, categoryId in enumerate(missing_votes):
-        print(f"{i + 1}. {categoryId}")
-
-    import json
-
-    with open("missing_votes.json", "w") as f:
-        json.dump(list(missing_votes), f, indent=4)
-
-    # for each of those categories, find how many other users voted
-    result = list(client["category_votes"].aggregate([
-        {
-            '$match': {
-                'categoryId': {'$in': list(missing_votes)},
-                'email': {"$ne": email_1}
-            }
-        }, {
-            '$group': {
-                '_id': '$categoryId', 
-                'total_votes': {'$sum': 1}
-            }
-        }
-    ]))
-
-    print("got", len(result), "results")
-    print(*result, sep="\n")
-
-
-    # for each category in missing_votes, check if there are products associated into the "products_for_voting"
-    prods = list(client["products_for_voting"].find(
-        {"categoryId": {"$in": list(missing_votes)}},
-        {"categoryId": 1, "id1688": 1, "_id": 0}
-    ))
-
-    print(len(prods), "products found")
-
-    print(*prods[:3], sep="\n")
-
-    # check how many of the missing categories are first-level categories
-    first_level_categories = list(client["categories"].find({"parentCateId": "0"}, {"categoryId": 1}))
-
-    first_level_categories_ids = set([c["categoryId"] for c in first_level_categories])
-
-    print("First level categories:", len(first_level_categories_ids))
-
-    missing_first_level = missing_votes.intersection(first_level_categories_ids)
-    print("Missing first level categories:", len(missing_first_level))
-    print("while total missing votes are", len(missing_votes))
-
-    # eliminate votes from those missing categories
-    res = client["category_votes"].delete_many({"categoryId": {"$in": list(missing_votes)}})
-    print(res.deleted_count, "votes deleted")
+    parser = argparse.ArgumentParser(description="Audit the vote coverage of all the voters")
+    parser.add_argument("--voters", nargs="+", default=None, help="restrict the audit to these voters")
+    parser.add_argument("--pair", nargs=2, metavar=("EMAIL", "OTHER"), default=None,
+                        help="list the categories voted by EMAIL but not by OTHER (default: EMAIL and EMAIL_2 from the secrets)")
+    parser.add_argument("--output", default="audit_report.json")
+    parser.add_argument("--delete", choices=["orphaned", "missing"], default=None,
+                        help="delete every vote on the orphaned categories, or on the ones missing for the pair")
+    parser.add_argument("--dry-run", action="store_true", help="with --delete, only count the votes")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--snapshot", default=None, help="audit this snapshot (scripts/snapshot.py) instead of the database")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        # no database load at all, only --delete still writes to it
+        from src import snapshot
+        votes_snapshot = snapshot.Snapshot(args.snapshot)
+        coverage = audit.Coverage.from_pairs(votes_snapshot.vote_pairs())
+        with_products = votes_snapshot.with_products()
+        first_level = votes_snapshot.first_level()
+    else:
+        # one pass over the votes for every voter, then two small reads
+        coverage = audit.Coverage.load(client)
+        with_products = set(db.heavy_reads(client)[db.PRODUCTS].distinct("categoryId"))
+        first_level = {c["categoryId"] for c in db.heavy_reads(client)[db.CATEGORIES].find({"parentCateId": "0"}, {"_id": 0, "categoryId": 1})}
+
+    report = audit.report(client, coverage, args.voters, with_products, first_level)
+
+    print(f"{len(report['voters'])} voters on {report['categories_voted']} categories, {report['voted_by_everyone']} voted by everyone")
+    print("Orphaned categories (no products):", len(report["orphaned_categories"]))
+    print("First level categories:", len(report["first_level_categories"]))
+
+    print("\nMissing votes per voter:")
+    for voter, missing in sorted(report["missing_per_voter"].items(), key=lambda x: -x[1]["missing"]):
+        print(f"\t{voter}\t{missing['missing']}\t({missing['missing_not_orphaned']} with products)")
+
+    pair = args.pair or [config.get("EMAIL"), config.get("EMAIL_2")]
+    if all(pair) and all(email in coverage.bits for email in pair):
+        report["pair"] = audit.pair_report(coverage, pair[0], pair[1], with_products, first_level)
+
+        print(f"\nCategories voted by {pair[0]} but not by {pair[1]}: {len(report['pair']['missing'])}")
+        for i, categoryId in enumerate(report["pair"]["missing"]):
+            print(f"{i + 1}. {categoryId}\t{report['pair']['votes_by_others'][categoryId]} other votes")
+        print("Missing categories with products:", len(report["pair"]["missing_with_products"]))
+        print("Missing first level categories:", len(report["pair"]["missing_first_level"]))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print("\nReport written to", args.output)
+
+    if args.delete:
+        if args.delete == "orphaned":
+            to_delete = report["orphaned_categories"]
+        elif "pair" in report:
+            to_delete = report["pair"]["missing"]
+        else:
+            parser.error("--delete missing needs a valid --pair")
+
+        res = audit.delete_votes(client, to_delete, chunk_size=args.chunk_size, dry_run=args.dry_run)
+        print(res, "votes", "would be deleted" if args.dry_run else "deleted")
+
+        if not args.dry_run and res:
+            results.rebuild(client)
@@ -0,0 +1,17 @@
+import argparse
+
+from src import db, snapshot
+
+client = db.connect()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export the votes, categories and voting catalog as Arrow files for offline analysis")
+    parser.add_argument("--output", default="snapshot", help="snapshot directory")
+    parser.add_argument("--full", action="store_true", help="export every vote again instead of only the ones since the last snapshot")
+    args = parser.parse_args()
+
+    stats = snapshot.export(client, args.output, full=args.full)
+
+    print(f"Exported {stats['new_votes']} votes into {args.output} ({stats['parts']} parts)")
+    print(f"Votes watermark: {stats['watermark']}, catalog version: {stats['catalog_version']}")
@@ -0,0 +1,32 @@
+import argparse
+import json
+import os
+import sys
+from pymongo.errors import PyMongoError
+
+from src import db, gallery, warmup
+
+client = db.connect()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Prepare the database and the thumbnails before the app takes traffic, "
+                                                 "e.g. python -m scripts.warmup && streamlit run voting_app.py")
+    parser.add_argument("--check", action="store_true", help="only check that the database answers and the catalog exists (health check)")
+    parser.add_argument("--thumbnails", type=int, default=9, help="thumbnails fetched for the first sub category of every macro category, 0 to skip them")
+    parser.add_argument("--max-thumbnails", type=int, default=300, help="cap on the thumbnails fetched in total")
+    args = parser.parse_args()
+
+    try:
+        if args.check:
+            stats = warmup.check(client)
+        else:
+            thumbnails = gallery.ThumbnailCache(os.getenv("THUMBNAIL_DIR", ".thumbnails")) if args.thumbnails else None
+            stats = warmup.warmup(client, thumbnails, args.thumbnails, args.max_thumbnails)
+            if thumbnails is not None:
+                thumbnails.close()
+    except (PyMongoError, RuntimeError) as e:
+        # a non zero exit keeps the traffic away
+        sys.exit(f"Warmup failed: {e}")
+
+    print(json.dumps(stats, indent=4))
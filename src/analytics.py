@@ -0,0 +1,196 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from scipy import sparse
+from pymongo import MongoClient
+
+from src import db, results, scoring
+from src.scoring import Scoring
+
+
+def _encode(values) -> tuple:
+    if not isinstance(values, (pa.Array, pa.ChunkedArray)):
+        # python strings: a dict over the few distinct values beats converting them all to Arrow
+        codes = {}
+        indices = np.fromiter((codes.setdefault(value, len(codes)) for value in values), np.int64, len(values))
+        return indices, list(codes)
+
+    # dictionary encoding in Arrow, much faster than np.unique on a million strings
+    encoded = pc.dictionary_encode(values)
+    if isinstance(encoded, pa.ChunkedArray):
+        encoded = encoded.unify_dictionaries().combine_chunks() if encoded.num_chunks else pa.array([], pa.string()).dictionary_encode()
+    return encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64), encoded.dictionary.to_pylist()
+
+
+class VoteMatrix:
+    """
+    Sparse voter x category matrix of the votes, the labels coded 1..k (0 is "no vote").
+
+    Everything below is computed with array operations on the (voter, category, label)
+    triplets, so the cost is a few passes over the votes whatever the question.
+    """
+
+    def __init__(self, voter_idx: np.ndarray, category_idx: np.ndarray, label_idx: np.ndarray,
+                 voters: list, category_ids: list, labels: list):
+        self.voter_idx = voter_idx
+        self.category_idx = category_idx
+        self.label_idx = label_idx
+        self.voters = voters
+        self.category_ids = category_ids
+        self.labels = labels
+
+    @classmethod
+    def from_arrays(cls, emails, category_ids, votes) -> "VoteMatrix":
+        voter_idx, voters = _encode(emails)
+        category_idx, categories = _encode(category_ids)
+        label_idx, labels = _encode(votes)
+        return cls(voter_idx, category_idx, label_idx, voters, categories, labels)
+
+    @classmethod
+    def load(cls, client: MongoClient) -> "VoteMatrix":
+        emails, category_ids, votes = [], [], []
+        collection = db.heavy_reads(client)[db.VOTES]
+        for doc in collection.find({}, {"_id": 0, "email": 1, "categoryId": 1, "vote": 1}, batch_size=10 * db.BATCH_SIZE):
+            emails.append(doc["email"])
+            category_ids.append(doc["categoryId"])
+            votes.append(doc["vote"])
+        return cls.from_arrays(emails, category_ids, votes)
+
+    @classmethod
+    def from_snapshot(cls, votes_snapshot) -> "VoteMatrix":
+        votes = votes_snapshot.votes()
+        return cls.from_arrays(votes["email"].cast(pa.string()), votes["categoryId"].cast(pa.string()), votes["vote"].cast(pa.string()))
+
+    @classmethod
+    def from_scoreboard(cls, scoreboard) -> "VoteMatrix":
+        votes = scoreboard.vote_triplets()
+        return cls.from_arrays([v[0] for v in votes], [v[1] for v in votes], [v[2] for v in votes])
+
+    @property
+    def n_votes(self) -> int:
+        return len(self.label_idx)
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.voters), len(self.category_ids)
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        return sparse.csr_matrix((self.label_idx + 1, (self.voter_idx, self.category_idx)), shape=self.shape, dtype=np.int8)
+
+    def weights(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> np.ndarray:
+        return np.array([scoring_rules.weight(label) for label in self.labels], dtype=np.float64)
+
+    def counts(self) -> np.ndarray:
+        """Votes per (category, label), shape categories x labels."""
+        k = len(self.labels)
+        flat = np.bincount(self.category_idx * k + self.label_idx, minlength=len(self.category_ids) * k)
+        return flat.reshape(len(self.category_ids), k)
+
+    def scores(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> np.ndarray:
+        return self.counts() @ self.weights(scoring_rules)
+
+    def bootstrap(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING, n: int = 200, confidence: float = 0.95,
+                  seed: int = 0, chunk_size: int = 4096) -> tuple:
+        """
+        Bootstrap interval of every category score, resampling its own votes.
+
+        Resampling n_i votes with replacement is a multinomial draw on the category's label
+        frequencies, so each replicate is drawn directly as label counts.
+        """
+        rng = np.random.default_rng(seed)
+        counts = self.counts()
+        weights = self.weights(scoring_rules)
+        totals = counts.sum(axis=1)
+        freqs = counts / np.maximum(totals, 1)[:, None]
+
+        low = np.empty(len(counts))
+        high = np.empty(len(counts))
+        q = [(1 - confidence) / 2, 1 - (1 - confidence) / 2]
+        for start in range(0, len(counts), chunk_size):
+            end = start + chunk_size
+            draws = rng.multinomial(totals[start:end], freqs[start:end], size=(n, min(end, len(counts)) - start))
+            low[start:end], high[start:end] = np.quantile(draws @ weights, q, axis=0)
+        return low, high
+
+    def voter_stats(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> dict:
+        """
+        Per voter: votes, leniency (mean weight given) and bias (mean distance from the
+        category's average weight, positive for voters kinder than the others).
+        """
+        vote_weights = self.weights(scoring_rules)[self.label_idx]
+        per_category = np.bincount(self.category_idx, minlength=len(self.category_ids))
+        category_mean = np.bincount(self.category_idx, vote_weights, minlength=len(self.category_ids)) / np.maximum(per_category, 1)
+
+        n_voters = len(self.voters)
+        votes = np.bincount(self.voter_idx, minlength=n_voters)
+        leniency = np.bincount(self.voter_idx, vote_weights, minlength=n_voters) / np.maximum(votes, 1)
+        bias = np.bincount(self.voter_idx, vote_weights - category_mean[self.category_idx], minlength=n_voters) / np.maximum(votes, 1)
+
+        return {
+            voter: {"votes": int(votes[i]), "leniency": round(float(leniency[i]), 4), "bias": round(float(bias[i]), 4)}
+            for i, voter in enumerate(self.voters)
+        }
+
+    def agreement(self) -> dict:
+        """
+        Inter-rater agreement on the labels: Fleiss' kappa (generalized to a varying number of
+        voters per category), Krippendorff's alpha (nominal), and per category the observed
+        agreement and kappa. Categories with a single vote carry no information and are left out.
+        """
+        counts = self.counts().astype(np.float64)
+        raters = counts.sum(axis=1)
+        rated = raters >= 2
+        counts, raters = counts[rated], raters[rated]
+        if not len(counts):
+            return {"fleiss_kappa": None, "krippendorff_alpha": None, "per_category": {}}
+
+        # Fleiss: share of agreeing pairs per category against the chance of the overall label mix
+        observed = ((counts * (counts - 1)).sum(axis=1)) / (raters * (raters - 1))
+        label_share = counts.sum(axis=0) / raters.sum()
+        expected = (label_share ** 2).sum()
+        kappa_per_category = (observed - expected) / (1 - expected) if expected < 1 else np.ones_like(observed)
+        kappa = (observed.mean() - expected) / (1 - expected) if expected < 1 else 1.0
+
+        # Krippendorff: coincidence matrix of the pairable values
+        coincidences = (counts / (raters - 1)[:, None]).T @ counts - np.diag((counts / (raters - 1)[:, None]).sum(axis=0))
+        marginals = coincidences.sum(axis=0)
+        total = marginals.sum()
+        disagreement_observed = coincidences.sum() - np.trace(coincidences)
+        disagreement_expected = (marginals.sum() ** 2 - (marginals ** 2).sum()) / (total - 1)
+        alpha = 1 - disagreement_observed / disagreement_expected if disagreement_expected else 1.0
+
+        category_ids = np.array(self.category_ids, dtype=object)[rated]
+        return {
+            "fleiss_kappa": round(float(kappa), 4),
+            "krippendorff_alpha": round(float(alpha), 4),
+            "per_category": {
+                category_id: {"agreement": round(float(a), 4), "kappa": round(float(k), 4)}
+                for category_id, a, k in zip(category_ids, observed, kappa_per_category)
+            },
+        }
+
+    def score_rows(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING, names: dict = None, bootstrap: int = 200) -> list:
+        """Same rows and order as results.get_scores, with the bootstrap interval of the score."""
+        counts = self.counts()
+        scores = counts @ self.weights(scoring_rules)
+        fields = [results.vote_field(label) for label in self.labels]
+        if bootstrap:
+            low, high = self.bootstrap(scoring_rules, n=bootstrap)
+
+        rows = []
+        for i in np.lexsort((np.array(self.category_ids, dtype=object), -scores)):
+            row = {
+                "categoryId": self.category_ids[i],
+                "name": (names or {}).get(self.category_ids[i]),
+                "total_votes": int(counts[i].sum()),
+                "voters": int(counts[i].sum()),
+                **{field: 0 for field in results.VOTE_FIELDS.values()}, results.BAD_VOTES_FIELD: 0,
+                "score": float(scores[i]),
+            }
+            for j, field in enumerate(fields):
+                row[field] += int(counts[i, j])
+            if bootstrap:
+                row["score_low"], row["score_high"] = float(low[i]), float(high[i])
+            rows.append(row)
+        return rows
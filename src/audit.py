@@ -0,0 +1,132 @@
+from itertools import combinations
+from pymongo import MongoClient
+
+from src import classification, db
+
+
+class Coverage:
+    """
+    Voter x category coverage matrix, one bitset per voter over the sorted category ids.
+
+    Built from a single aggregation over `category_votes`, every pair or group question is
+    then answered with bit operations instead of more queries.
+    """
+
+    def __init__(self, voted: dict):
+        self.category_ids = sorted({c for ids in voted.values() for c in ids})
+        self.index = {c: i for i, c in enumerate(self.category_ids)}
+        self.bits = {email: self.to_bits(ids) for email, ids in voted.items()}
+        self.all_bits = (1 << len(self.category_ids)) - 1
+
+    @classmethod
+    def load(cls, client: MongoClient) -> "Coverage":
+        voted = db.heavy_reads(client)[db.VOTES].aggregate([
+            {'$group': {'_id': '$email', 'categories': {'$addToSet': '$categoryId'}}}
+        ], allowDiskUse=True, batchSize=db.BATCH_SIZE)
+        return cls({doc["_id"]: doc["categories"] for doc in voted})
+
+    @classmethod
+    def from_pairs(cls, pairs) -> "Coverage":
+        voted = {}
+        for email, category_id in pairs:
+            voted.setdefault(email, set()).add(category_id)
+        return cls(voted)
+
+    @property
+    def voters(self) -> list:
+        return sorted(self.bits)
+
+    def to_bits(self, category_ids) -> int:
+        bits = 0
+        for category_id in category_ids:
+            if category_id in self.index:
+                bits |= 1 << self.index[category_id]
+        return bits
+
+    def to_ids(self, bits: int) -> list:
+        ids = []
+        while bits:
+            low = bits & -bits
+            ids.append(self.category_ids[low.bit_length() - 1])
+            bits ^= low
+        return ids
+
+    def missing(self, voter: str, other: str) -> int:
+        """Categories voted by `voter` but not by `other`."""
+        return self.bits[voter] & ~self.bits[other]
+
+    def group_union(self, voters: list) -> int:
+        bits = 0
+        for voter in voters:
+            bits |= self.bits[voter]
+        return bits
+
+    def group_intersection(self, voters: list) -> int:
+        bits = self.all_bits
+        for voter in voters:
+            bits &= self.bits[voter]
+        return bits
+
+    def voters_per_category(self, voters: list = None) -> dict:
+        counts = dict.fromkeys(self.category_ids, 0)
+        for voter in voters or self.voters:
+            for category_id in self.to_ids(self.bits[voter]):
+                counts[category_id] += 1
+        return counts
+
+
+def report(client: MongoClient, coverage: Coverage, voters: list = None, with_products: set = None, first_level: set = None) -> dict:
+    voters = voters or coverage.voters
+
+    # two cheap reads, then everything is bit operations
+    if with_products is None:
+        with_products = set(db.heavy_reads(client)[db.PRODUCTS].distinct("categoryId"))
+    if first_level is None:
+        first_level = {c["categoryId"] for c in db.heavy_reads(client)[db.CATEGORIES].find({"parentCateId": "0"}, {"_id": 0, "categoryId": 1})}
+
+    union = coverage.group_union(voters)
+    orphaned = union & ~coverage.to_bits(with_products)
+    first_level_bits = coverage.to_bits(first_level)
+
+    return {
+        "voters": {voter: bin(coverage.bits[voter]).count("1") for voter in voters},
+        "categories_voted": bin(union).count("1"),
+        "voted_by_everyone": bin(coverage.group_intersection(voters)).count("1"),
+        "orphaned_categories": coverage.to_ids(orphaned),
+        "first_level_categories": coverage.to_ids(union & first_level_bits),
+        "missing_per_voter": {
+            voter: {
+                "missing": bin(union & ~coverage.bits[voter]).count("1"),
+                "missing_not_orphaned": bin(union & ~coverage.bits[voter] & ~orphaned).count("1"),
+            }
+            for voter in voters
+        },
+        "missing_per_pair": [
+            {"voter": a, "other": b, "a_not_b": bin(coverage.missing(a, b)).count("1"), "b_not_a": bin(coverage.missing(b, a)).count("1")}
+            for a, b in combinations(voters, 2)
+        ],
+    }
+
+
+def pair_report(coverage: Coverage, voter: str, other: str, with_products: set, first_level: set) -> dict:
+    missing = coverage.missing(voter, other)
+    others = [v for v in coverage.voters if v != voter]
+    votes_by_others = coverage.voters_per_category(others)
+    missing_ids = coverage.to_ids(missing)
+
+    return {
+        "voter": voter,
+        "other": other,
+        "missing": missing_ids,
+        "votes_by_others": {c: votes_by_others[c] for c in missing_ids},
+        "missing_with_products": [c for c in missing_ids if c in with_products],
+        "missing_first_level": [c for c in missing_ids if c in first_level],
+    }
+
+
+def delete_votes(client: MongoClient, category_ids: list, chunk_size: int = 1000, max_per_second: float = None,
+                 dry_run: bool = False) -> int:
+    # destructive, never called by the audit itself
+    return classification.delete_in_chunks(
+        client, db.VOTES, {"categoryId": {"$in": category_ids}}, chunk_size=chunk_size, max_per_second=max_per_second, dry_run=dry_run
+    )
@@ -0,0 +1,146 @@
+import math
+import threading
+import time
+from typing import NamedTuple
+from pymongo import MongoClient
+
+from src import catalog_builder
+
+
+class Product(NamedTuple):
+    id1688: str
+    image: str
+    title: str
+    sales: int
+
+
+class SubCategory:
+    __slots__ = ("index", "categoryId", "name", "parentCateId", "tot", "tot_sales", "products")
+
+    def __init__(self, index: int, doc: dict):
+        self.index = index  # bit of this sub category in the voters' bitsets
+        self.categoryId = doc["categoryId"]
+        self.name = doc.get("name")
+        self.parentCateId = doc.get("parentCateId")
+        self.tot = doc.get("tot", 0)
+        self.tot_sales = doc.get("tot_sales", 0)
+        self.products = tuple(Product(p.get("id1688"), p.get("image"), p.get("title"), p.get("sales")) for p in doc.get("products", []))
+
+
+class MacroCategory:
+    __slots__ = ("categoryId", "name", "importance", "sub_categories", "start", "positions")
+
+    def __init__(self, doc: dict, start: int):
+        self.categoryId = doc["_id"]
+        self.name = doc.get("name")
+        self.importance = doc.get("importance")
+        # the sub categories of a macro category take the bits [start, start + len) of the bitsets
+        self.sub_categories = tuple(SubCategory(start + i, sub) for i, sub in enumerate(doc["sub_categories"]))
+        self.start = start
+        self.positions = {sub.name: sub for sub in self.sub_categories}
+
+    def __len__(self) -> int:
+        return len(self.sub_categories)
+
+    def mask(self, bits: int) -> int:
+        """The part of `bits` that belongs to this macro category, shifted down to bit 0."""
+        return (bits >> self.start) & ((1 << len(self.sub_categories)) - 1)
+
+
+class CatalogSnapshot:
+    """One immutable version of the tree, shared by every session."""
+
+    __slots__ = ("version", "macro_categories", "sub_categories", "by_id", "macro_by_id")
+
+    def __init__(self, version: int, docs: list):
+        self.version = version
+
+        macro_categories = []
+        start = 0
+        for doc in sorted(docs, key=lambda x: len(x["sub_categories"]), reverse=True):
+            macro_categories.append(MacroCategory(doc, start))
+            start += len(doc["sub_categories"])
+
+        self.macro_categories = tuple(macro_categories)
+        self.sub_categories = tuple(sub for macro in self.macro_categories for sub in macro.sub_categories)
+        self.by_id = {sub.categoryId: sub for sub in self.sub_categories}
+        self.macro_by_id = {macro.categoryId: macro for macro in self.macro_categories}
+
+    @property
+    def size(self) -> int:
+        return len(self.sub_categories)
+
+    def to_bits(self, category_ids) -> tuple:
+        """Bitset of the `category_ids` in this snapshot, and the ids it does not know about."""
+        bits = 0
+        unknown = []
+        for category_id in category_ids:
+            sub = self.by_id.get(category_id)
+            if sub is None:
+                unknown.append(category_id)
+            else:
+                bits |= 1 << sub.index
+        return bits, unknown
+
+    def to_ids(self, bits: int) -> list:
+        ids = []
+        while bits:
+            low = bits & -bits
+            ids.append(self.sub_categories[low.bit_length() - 1].categoryId)
+            bits ^= low
+        return ids
+
+
+class Catalog:
+    """
+    Process-wide macro -> sub-category -> products tree.
+
+    The tree is materialized in `voting_catalog` by `catalog_builder` (scripts/build_catalog.py).
+    A refresh only reads the version in `catalog_meta` and reloads the collection with a
+    single `find` when it changed, into a new immutable `CatalogSnapshot`. Sessions never get
+    their own copy, they keep a bitset of the voted sub categories against the snapshot.
+    """
+
+    def __init__(self, client: MongoClient, min_refresh_interval: float = 30):
+        self.client = client
+        self.min_refresh_interval = min_refresh_interval
+
+        self._lock = threading.Lock()
+        self._source_version = None
+        # monotonic() can be below the interval on a freshly booted host, the first refresh always runs
+        self._last_refresh = -math.inf
+
+        self.snapshot = CatalogSnapshot(0, [])
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def size(self) -> int:
+        return self.snapshot.size
+
+    def refresh(self, force: bool = False) -> bool:
+        if not force and time.monotonic() - self._last_refresh < self.min_refresh_interval:
+            return False
+
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < self.min_refresh_interval:
+                return False
+            self._last_refresh = time.monotonic()
+
+            source_version = catalog_builder.get_version(self.client)
+            if source_version is None:
+                # nobody ran the build job yet, do it once from here
+                source_version = catalog_builder.build(self.client)["version"]
+
+            if source_version is None or source_version == self._source_version:
+                return False
+
+            docs = list(self.client[catalog_builder.CATALOG_COLLECTION].find({}, {"updated_at": 0}))
+
+            # swapped in one assignment, readers keep whatever snapshot they already hold
+            self.snapshot = CatalogSnapshot(self.snapshot.version + 1, docs)
+            self._source_version = source_version
+            print(f"Catalog refreshed: {self.snapshot.size} sub categories in {len(self.snapshot.macro_categories)} macro categories")
+            return True
@@ -0,0 +1,191 @@
+import time
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure
+
+from src import db
+
+
+CATALOG_COLLECTION = db.CATALOG
+META_COLLECTION = db.CATALOG_META
+META_ID = "voting_catalog"
+
+PRODUCTS_PER_CATEGORY = 10
+
+# an incremental build only sees new products: sales, deleted products and renamed
+# categories reach the catalog with the next full build, at least this often
+FULL_BUILD_EVERY = 24 * 3600
+
+
+def ensure_indexes(client: MongoClient):
+    client[db.PRODUCTS].create_index([("categoryId", ASCENDING), ("soldOut", DESCENDING)])
+    client[db.CATEGORIES].create_index([("categoryId", ASCENDING)])
+    client[db.CATEGORIES].create_index([("parentCateId", ASCENDING)])
+
+
+def get_version(client: MongoClient):
+    meta = client[META_COLLECTION].find_one({"_id": META_ID}, {"version": 1})
+    return None if meta is None else meta["version"]
+
+
+PRODUCT_FIELDS = {'id1688': '$id1688', 'image': '$imgUrl', 'title': '$title', 'sales': '$soldOut'}
+
+
+def sub_categories_pipeline(category_ids: list = None, limit: int = PRODUCTS_PER_CATEGORY) -> list:
+    # one best-selling copy per id1688, then the top `limit` per category, ties broken by id1688
+    pipeline = [] if category_ids is None else [{'$match': {'categoryId': {'$in': category_ids}}}]
+    pipeline += [
+        {
+            '$group': {
+                '_id': {'categoryId': '$categoryId', 'id1688': '$id1688'},
+                'product': {'$top': {'sortBy': {'soldOut': -1, '_id': 1}, 'output': PRODUCT_FIELDS}},
+                'tot': {'$sum': 1},
+                'tot_sales': {'$sum': '$soldOut'}
+            }
+        }, {
+            '$group': {
+                '_id': '$_id.categoryId',
+                'products': {'$topN': {'n': limit, 'sortBy': {'product.sales': -1, 'product.id1688': 1}, 'output': '$product'}},
+                'tot': {'$sum': '$tot'},
+                'tot_sales': {'$sum': '$tot_sales'}
+            }
+        }
+    ]
+    return pipeline
+
+
+def sub_categories_pipeline_sorted(category_ids: list = None, limit: int = PRODUCTS_PER_CATEGORY) -> list:
+    # same selection for servers without $top/$topN (< 5.2): sort on the {categoryId, soldOut} index then group
+    pipeline = [] if category_ids is None else [{'$match': {'categoryId': {'$in': category_ids}}}]
+    pipeline += [
+        {'$sort': {'categoryId': 1, 'soldOut': -1, 'id1688': 1, '_id': 1}},
+        {
+            '$group': {
+                '_id': {'categoryId': '$categoryId', 'id1688': '$id1688'},
+                'product': {'$first': PRODUCT_FIELDS},
+                'tot': {'$sum': 1},
+                'tot_sales': {'$sum': '$soldOut'}
+            }
+        },
+        {'$sort': {'_id.categoryId': 1, 'product.sales': -1, 'product.id1688': 1}},
+        {
+            '$group': {
+                '_id': '$_id.categoryId',
+                'products': {'$push': '$product'},
+                'tot': {'$sum': '$tot'},
+                'tot_sales': {'$sum': '$tot_sales'}
+            }
+        }, {
+            '$addFields': {'products': {'$slice': ['$products', limit]}}
+        }
+    ]
+    return pipeline
+
+
+def _aggregate_sub_categories(client: MongoClient, category_ids: list = None, limit: int = PRODUCTS_PER_CATEGORY) -> list:
+    collection = client[db.PRODUCTS]
+    try:
+        return list(collection.aggregate(sub_categories_pipeline(category_ids, limit), allowDiskUse=True))
+    except (OperationFailure, NotImplementedError) as e:
+        print(f"$topN not available, falling back to sort and group: {e}")
+        return list(collection.aggregate(sub_categories_pipeline_sorted(category_ids, limit), allowDiskUse=True))
+
+
+def _sub_category_entries(client: MongoClient, category_ids: list = None, limit: int = PRODUCTS_PER_CATEGORY) -> dict:
+    sub_categories = _aggregate_sub_categories(client, category_ids, limit)
+
+    ids = [c["_id"] for c in sub_categories]
+    categories = {c["categoryId"]: c for c in client[db.CATEGORIES].find({"categoryId": {"$in": ids}}, {"_id": 0})}
+
+    entries = {}
+    for sub_category in sub_categories:
+        category = categories.get(sub_category["_id"])
+        if category is None:
+            continue
+
+        for prod in sub_category["products"]:
+            if not prod.get("image"):
+                prod["image"] = None
+
+        entries[sub_category["_id"]] = {
+            "categoryId": sub_category["_id"],
+            "name": category.get("name"),
+            "parentCateId": category.get("parentCateId"),
+            "tot": sub_category["tot"],
+            "tot_sales": sub_category["tot_sales"],
+            "products": sub_category["products"],
+        }
+    return entries
+
+
+def _macro_document(parent: dict, sub_categories: list) -> dict:
+    sub_categories.sort(key=lambda x: x["name"] or "")
+    return {
+        "_id": parent["categoryId"],
+        "name": parent.get("name", "All primary categories"),
+        "importance": parent.get("importance"),
+        "sub_categories": sub_categories,
+        "tot_sub_categories": len(sub_categories),
+        "tot_products": sum(c["tot"] for c in sub_categories),
+        "tot_sales": sum(c["tot_sales"] for c in sub_categories),
+        "updated_at": time.time(),
+    }
+
+
+def build(client: MongoClient, full: bool = False, limit: int = PRODUCTS_PER_CATEGORY,
+          full_every: float = FULL_BUILD_EVERY) -> dict:
+    """
+    Materialize one document per macro category into `voting_catalog`.
+
+    Only the sub categories that got new products since the last run are recomputed, unless
+    `full` is set or the last full build is more than `full_every` seconds old: changed
+    sales, deleted products and renamed categories are only picked up by a full build.
+    Every run that changes something bumps the version in `catalog_meta`, which is what
+    the app polls.
+    """
+    ensure_indexes(client)
+
+    meta = client[META_COLLECTION].find_one({"_id": META_ID}) or {}
+    newest = client[db.PRODUCTS].find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+    if newest is None:
+        return {"changed_sub_categories": 0, "changed_macro_categories": 0, "version": meta.get("version"), "full": False}
+
+    full = full or not meta or time.time() - meta.get("last_full_at", 0) >= full_every
+    if not full and newest["_id"] <= meta["last_product_id"]:
+        return {"changed_sub_categories": 0, "changed_macro_categories": 0, "version": meta["version"], "full": False}
+
+    changed_ids = None if full else client[db.PRODUCTS].distinct("categoryId", {"_id": {"$gt": meta["last_product_id"]}})
+    entries = _sub_category_entries(client, changed_ids, limit)
+
+    parent_ids = list({c["parentCateId"] for c in entries.values()})
+    parents = {c["categoryId"]: c for c in client[db.CATEGORIES].find({"categoryId": {"$in": parent_ids}}, {"_id": 0})}
+
+    by_parent = {}
+    for entry in entries.values():
+        if entry["parentCateId"] in parents:
+            by_parent.setdefault(entry["parentCateId"], {})[entry["categoryId"]] = entry
+
+    if not full:
+        # merge into the stored macro categories, keeping their untouched sub categories
+        for doc in client[CATALOG_COLLECTION].find({"_id": {"$in": list(by_parent)}}, {"sub_categories": 1}):
+            for sub_category in doc["sub_categories"]:
+                by_parent[doc["_id"]].setdefault(sub_category["categoryId"], sub_category)
+
+    operations = [
+        ReplaceOne({"_id": parent_id}, _macro_document(parents[parent_id], list(sub_categories.values())), upsert=True)
+        for parent_id, sub_categories in by_parent.items()
+    ]
+    if operations:
+        client[CATALOG_COLLECTION].bulk_write(operations, ordered=False)
+    if full:
+        client[CATALOG_COLLECTION].delete_many({"_id": {"$nin": list(by_parent)}})
+
+    meta = client[META_COLLECTION].find_one_and_update(
+        {"_id": META_ID},
+        {"$inc": {"version": 1}, "$set": {
+            "last_product_id": newest["_id"], "updated_at": time.time(), **({"last_full_at": time.time()} if full else {}),
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+    return {"changed_sub_categories": len(entries), "changed_macro_categories": len(operations), "version": meta["version"], "full": full}
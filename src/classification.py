@@ -0,0 +1,83 @@
+import time
+from pymongo import MongoClient, UpdateMany
+
+from src import db, scoring
+from src.scoring import Scoring
+
+
+def desired_statuses(category_votes: list, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> dict:
+    return {c["categoryId"]: scoring_rules.status(c["score"]) for c in category_votes}
+
+
+def current_statuses(client: MongoClient) -> dict:
+    return {
+        c["categoryId"]: c["confirmation_status"]
+        for c in client[db.CATEGORIES].find({"confirmation_status": {"$exists": True}}, {"_id": 0, "categoryId": 1, "confirmation_status": 1})
+    }
+
+
+def diff(desired: dict, current: dict) -> list:
+    """(categoryId, old status, new status) for every category to touch, new is None to unset it."""
+    changes = [(category_id, current.get(category_id), status) for category_id, status in desired.items() if current.get(category_id) != status]
+    changes += [(category_id, status, None) for category_id, status in current.items() if category_id not in desired]
+    return changes
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class RateLimiter:
+    def __init__(self, max_per_second: float = None):
+        self.max_per_second = max_per_second
+        self._next = time.monotonic()
+
+    def wait(self, n: int):
+        if not self.max_per_second:
+            return
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(now, self._next) + n / self.max_per_second
+
+
+def apply_statuses(client: MongoClient, changes: list, chunk_size: int = 500, max_per_second: float = None,
+                   dry_run: bool = False) -> int:
+    if dry_run or not changes:
+        return 0
+
+    operations = [
+        UpdateMany({"categoryId": category_id}, {"$unset": {"confirmation_status": ""}} if new is None else {"$set": {"confirmation_status": new}})
+        for category_id, _, new in changes
+    ]
+
+    modified = 0
+    limiter = RateLimiter(max_per_second)
+    for chunk in _chunks(operations, chunk_size):
+        limiter.wait(len(chunk))
+        modified += client[db.CATEGORIES].bulk_write(chunk, ordered=False).modified_count
+    return modified
+
+
+def delete_in_chunks(client: MongoClient, collection: str, query: dict, chunk_size: int = 1000,
+                     max_per_second: float = None, dry_run: bool = False) -> int:
+    # deleting by batches of _id keeps every write small, whatever the number of matching documents
+    if dry_run:
+        return client[collection].count_documents(query)
+
+    deleted = 0
+    limiter = RateLimiter(max_per_second)
+    while True:
+        ids = [doc["_id"] for doc in client[collection].find(query, {"_id": 1}).limit(chunk_size)]
+        if not ids:
+            return deleted
+        limiter.wait(len(ids))
+        deleted += client[collection].delete_many({"_id": {"$in": ids}}).deleted_count
+
+
+def delete_products(client: MongoClient, category_ids: list, collection: str = db.WINNING_PRODUCTS,
+                    chunk_size: int = 1000, max_per_second: float = None, dry_run: bool = False) -> int:
+    if not category_ids:
+        return 0
+    return delete_in_chunks(client, collection, {"categoryId": {"$in": category_ids}}, chunk_size, max_per_second, dry_run)
@@ -0,0 +1,151 @@
+import importlib.util
+import threading
+import tomllib
+from pymongo import MongoClient, ReadPreference, monitoring
+from pymongo.common import MAX_POOL_SIZE
+from pymongo.database import Database
+
+
+SECRETS_FILE = ".streamlit/secrets.toml"
+
+# every collection the app and the scripts touch
+VOTES = "category_votes"
+CATEGORIES = "categories"
+PRODUCTS = "products_for_voting"
+WINNING_PRODUCTS = "hot1688_winning_products"
+CATALOG = "voting_catalog"
+CATALOG_META = "catalog_meta"
+SCORES = "category_scores"
+TALLIES = "voter_tallies"
+
+# documents per round trip of the cursors that read whole collections
+BATCH_SIZE = 1000
+
+# overridden by a [mongo] table in the secrets, e.g. maxPoolSize = 100
+CLIENT_OPTIONS = {
+    "appname": "voting-category-app",
+    "maxPoolSize": 50,
+    "minPoolSize": 2,
+    "maxIdleTimeMS": 60000,
+    "maxConnecting": 4,
+    "waitQueueTimeoutMS": 5000,
+    "connectTimeoutMS": 5000,
+    "serverSelectionTimeoutMS": 10000,
+    "socketTimeoutMS": 30000,
+    "retryWrites": True,
+    "retryReads": True,
+}
+
+# the compressors whose library is installed (pymongo[zstd,snappy] in the requirements), best
+# first, the server picks the first it knows
+COMPRESSORS = [name for name, module in (("zstd", "zstandard"), ("snappy", "snappy")) if importlib.util.find_spec(module)] + ["zlib"]
+
+_MOCK_CLIENTS = {}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Size, connections in use and waits of the connection pool of every server."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pools = {}
+
+    def _pool(self, address) -> dict:
+        key = f"{address[0]}:{address[1]}"
+        return self.pools.setdefault(key, {
+            "max_size": None, "open": 0, "in_use": 0, "peak_in_use": 0, "waiting": 0, "checkouts": 0, "checkout_timeouts": 0, "cleared": 0,
+        })
+
+    def _change(self, address, **deltas):
+        with self._lock:
+            pool = self._pool(address)
+            for field, delta in deltas.items():
+                pool[field] += delta
+            pool["peak_in_use"] = max(pool["peak_in_use"], pool["in_use"])
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)["max_size"] = event.options.get("maxPoolSize", MAX_POOL_SIZE)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._change(event.address, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._change(event.address, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._change(event.address, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._change(event.address, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        timeouts = int(event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT)
+        self._change(event.address, waiting=-1, checkout_timeouts=timeouts)
+
+    def connection_checked_out(self, event):
+        self._change(event.address, waiting=-1, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._change(event.address, in_use=-1)
+
+    def snapshot(self) -> dict:
+        # saturation is the share of the pool in use, past 1 the requests queue for a connection
+        with self._lock:
+            return {
+                address: {**pool, "saturation": round(pool["in_use"] / pool["max_size"], 3) if pool["max_size"] else None}
+                for address, pool in self.pools.items()
+            }
+
+
+POOL_STATS = PoolStats()
+
+
+def load_config(path: str = SECRETS_FILE) -> dict:
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def connect(config: dict = None, event_listeners: list = None) -> Database:
+    """
+    Database of the app and the scripts, from the MONGO_URL and MONGO_DB_NAME of `config`
+    (the secrets file when None). A `mongomock://` url gives an in-memory database, the same
+    one for every connect with that url in the process.
+    """
+    config = load_config() if config is None else config
+    url, db_name = config["MONGO_URL"], config["MONGO_DB_NAME"]
+
+    if url.startswith("mongomock://"):
+        import mongomock
+
+        if url not in _MOCK_CLIENTS:
+            _MOCK_CLIENTS[url] = mongomock.MongoClient()
+        return _MOCK_CLIENTS[url][db_name]
+
+    options = {**CLIENT_OPTIONS, "compressors": COMPRESSORS, **config.get("mongo", {})}
+    client = MongoClient(url, event_listeners=[POOL_STATS, *(event_listeners or [])], **options)
+    return client[db_name]
+
+
+def primary(client: Database) -> Database:
+    # the votes and the reads right before writing them, whatever the url asks for
+    return client.with_options(read_preference=ReadPreference.PRIMARY)
+
+
+def heavy_reads(client: Database) -> Database:
+    # results, audits, analytics and exports read from a secondary when there is one, the
+    # primary stays for the votes and the reads that must see them
+    return client.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+
+def pool_stats() -> dict:
+    return POOL_STATS.snapshot()
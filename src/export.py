@@ -0,0 +1,53 @@
+import csv
+import io
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from itertools import islice
+
+from src import results
+
+
+RESULTS_SCHEMA = pa.schema([
+    ("categoryId", pa.string()),
+    ("name", pa.string()),
+    ("status", pa.string()),
+    ("score", pa.float64()),
+    ("total_votes", pa.int64()),
+    ("voters", pa.int64()),
+    ("good_votes", pa.int64()),
+    ("mid_votes", pa.int64()),
+    ("bad_votes", pa.int64()),
+])
+
+# past this size the file being built moves from memory to a temporary file
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def _chunks(rows, chunk_size: int):
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def to_csv(rows, columns: list = results.RESULT_COLUMNS, chunk_size: int = 1000):
+    """CSV of `rows`, written `chunk_size` rows at a time. Returns a binary file at its start."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.DictWriter(text, columns, extrasaction="ignore")
+    writer.writeheader()
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+    text.detach()
+    out.seek(0)
+    return out
+
+
+def to_parquet(rows, schema: pa.Schema = RESULTS_SCHEMA, chunk_size: int = 10000):
+    """Parquet of `rows`, one row group per `chunk_size` rows. Returns a binary file at its start."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in _chunks(rows, chunk_size):
+            writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
+    out.seek(0)
+    return out
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch_url(url: str, timeout: float = 10) -> bytes:
+    request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def downscale(data: bytes, size: tuple = (300, 300), image_format: str = "WEBP", quality: int = 80) -> bytes:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(size)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        if image_format == "JPEG" and image.mode == "RGBA":
+            image = image.convert("RGB")
+
+        out = io.BytesIO()
+        image.save(out, format=image_format, quality=quality)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """
+    On-disk cache of downscaled product images.
+
+    Every image url is fetched and downscaled once, then served from disk. Files are touched
+    on every hit and the least recently used ones are evicted when the directory grows over
+    `max_bytes`. A url that failed is not tried again for `retry_after` seconds.
+    `fetcher(url) -> bytes` can be swapped, e.g. for a local fake server in tests.
+    """
+
+    def __init__(self, directory: str = ".thumbnails", max_bytes: int = 200 * 1024 * 1024, size: tuple = (300, 300),
+                 image_format: str = "WEBP", fetcher=fetch_url, workers: int = 8, retry_after: float = 300):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = size
+        self.image_format = image_format
+        self.fetcher = fetcher
+        self.retry_after = retry_after
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._queued = set()
+        self._failed = {}  # url -> time of the failure
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        self._total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest())
+
+    def _has_failed(self, url: str) -> bool:
+        failed_at = self._failed.get(url)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at < self.retry_after:
+            return True
+        self._failed.pop(url, None)
+        return False
+
+    def get(self, url: str, wait: bool = True):
+        """
+        Thumbnail of `url`. On a miss it is downloaded right away, or with `wait=False`
+        queued in the background and None is returned (the caller shows the remote image).
+        """
+        if not url or self._has_failed(url):
+            return None
+
+        path = self.path(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data or None
+        except FileNotFoundError:
+            pass
+
+        if not wait:
+            self.prefetch([url])
+            return None
+        return self._fetch(url, path)
+
+    def prefetch(self, urls: list) -> list:
+        """Queue the downloads of the urls not cached yet, returns their futures."""
+        futures = []
+        for url in urls:
+            if not url or self._has_failed(url) or os.path.exists(self.path(url)):
+                continue
+            with self._lock:
+                # already queued or downloading, a second task would only wait for the first
+                if url in self._queued or url in self._in_flight:
+                    continue
+                self._queued.add(url)
+            futures.append(self._executor.submit(self._prefetch_one, url))
+        return futures
+
+    def _prefetch_one(self, url: str):
+        try:
+            return self.get(url)
+        finally:
+            with self._lock:
+                self._queued.discard(url)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _fetch(self, url: str, path: str):
+        # several sessions asking for the same image wait for a single download
+        with self._lock:
+            event = self._in_flight.get(url)
+            owner = event is None
+            if owner:
+                event = self._in_flight[url] = threading.Event()
+
+        if not owner:
+            event.wait(30)
+            return self.get(url) if os.path.exists(path) else None
+
+        try:
+            data = downscale(self.fetcher(url), self.size, self.image_format)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error fetching thumbnail {url}: {e}")
+            self._failed[url] = time.monotonic()
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.pop(url, None)
+            event.set()
+
+        with self._lock:
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+        return data
+
+    def _evict(self):
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith(".tmp")
+        )
+        self._total_bytes = sum(size for _, size, _ in entries)
+
+        # drop down to 90% so that we don't evict on every new image
+        for _, size, path in entries:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from pymongo import monitoring
+
+
+# everything below is a no-op unless METRICS=true, the spans then cost a single function call
+ENABLED = os.getenv("METRICS", "").lower() == "true"
+
+SAMPLES = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+_NO_SPAN = nullcontext()
+
+
+class Rerun:
+    __slots__ = ("start", "end", "commands", "committed")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.commands = 0
+        self.committed = False
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.started_at = time.time()
+        self.stage_durations = defaultdict(lambda: deque(maxlen=SAMPLES))
+        self.stage_commands = defaultdict(int)
+        self.rerun_durations = deque(maxlen=SAMPLES)
+        self.rerun_commands = deque(maxlen=SAMPLES)
+        self.rerun_times = deque(maxlen=SAMPLES)
+        self.reruns = 0
+        self.votes = 0
+
+        self.commands = defaultdict(int)            # (collection, command) -> count
+        self.command_seconds = defaultdict(float)   # (collection, command) -> total duration
+        self._pending_commands = {}
+
+    # ---------------------------- script runs ----------------------------
+
+    def start_rerun(self, previous: Rerun = None) -> Rerun:
+        # a script run can end with st.rerun/st.stop, so the previous run is closed by the next one
+        if previous is not None:
+            self.commit_rerun(previous)
+        rerun = Rerun()
+        self._local.rerun = rerun
+        self._local.stages = []
+        return rerun
+
+    def commit_rerun(self, rerun: Rerun):
+        with self._lock:
+            if rerun.committed:
+                return
+            rerun.committed = True
+            self.reruns += 1
+            self.rerun_durations.append(rerun.end - rerun.start)
+            self.rerun_commands.append(rerun.commands)
+            self.rerun_times.append(time.time())
+
+    @contextmanager
+    def span(self, stage: str):
+        stages = getattr(self._local, "stages", None)
+        if stages is None:
+            stages = self._local.stages = []
+        stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stages.pop()
+            with self._lock:
+                self.stage_durations[stage].append(end - start)
+            rerun = getattr(self._local, "rerun", None)
+            if rerun is not None:
+                rerun.end = end
+
+    def count_vote(self, n: int = 1):
+        with self._lock:
+            self.votes += n
+
+    def set_thread_stage(self, stage: str):
+        # the stage of every command of the calling thread outside a script run or span
+        self._local.thread_stage = stage
+
+    # ---------------------------- mongo commands ----------------------------
+
+    def command_started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        # threads that never ran a script count under their own stage, the vote writer as background
+        stages = getattr(self._local, "stages", None)
+        stage = getattr(self._local, "thread_stage", "background") if stages is None else (stages[-1] if stages else "script")
+        self._pending_commands[(event.connection_id, event.request_id)] = (collection, stage)
+
+        rerun = getattr(self._local, "rerun", None)
+        if rerun is not None:
+            rerun.commands += 1
+
+    def command_finished(self, event):
+        collection, stage = self._pending_commands.pop((event.connection_id, event.request_id), ("", "background"))
+        key = (collection, event.command_name)
+        with self._lock:
+            self.commands[key] += 1
+            self.command_seconds[key] += event.duration_micros / 1e6
+            self.stage_commands[stage] += 1
+
+    # ---------------------------- reports ----------------------------
+
+    @staticmethod
+    def _quantiles(samples) -> dict:
+        ordered = sorted(samples)
+        if not ordered:
+            return {}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            window_start = time.time() - 60
+            recent_reruns = sum(1 for t in self.rerun_times if t >= window_start)
+            vote_commands = self.stage_commands.get("on_vote", 0) + self.stage_commands.get("background", 0)
+
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "reruns": self.reruns,
+                "reruns_per_second": round(recent_reruns / 60, 3),
+                "rerun_seconds": self._quantiles(self.rerun_durations),
+                "round_trips_per_rerun": self._quantiles(self.rerun_commands),
+                "votes": self.votes,
+                "round_trips_per_vote": round(vote_commands / self.votes, 2) if self.votes else None,
+                # the threads' stages have round trips only
+                "stages": {
+                    stage: {
+                        "count": len(self.stage_durations.get(stage, ())),
+                        "seconds": self._quantiles(self.stage_durations.get(stage, ())),
+                        "round_trips": self.stage_commands.get(stage, 0),
+                    }
+                    for stage in [*self.stage_durations, *(stage for stage in self.stage_commands if stage not in self.stage_durations)]
+                },
+                "commands": {
+                    f"{collection}.{command}": {"count": n, "seconds": round(self.command_seconds[(collection, command)], 4)}
+                    for (collection, command), n in sorted(self.commands.items())
+                },
+            }
+
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE voting_reruns_total counter",
+            f"voting_reruns_total {snapshot['reruns']}",
+            "# TYPE voting_reruns_per_second gauge",
+            f"voting_reruns_per_second {snapshot['reruns_per_second']}",
+            "# TYPE voting_votes_total counter",
+            f"voting_votes_total {snapshot['votes']}",
+        ]
+        if snapshot["round_trips_per_vote"] is not None:
+            lines += ["# TYPE voting_round_trips_per_vote gauge", f"voting_round_trips_per_vote {snapshot['round_trips_per_vote']}"]
+
+        lines.append("# TYPE voting_rerun_seconds summary")
+        lines += [f'voting_rerun_seconds{{quantile="{q}"}} {v:.6f}' for q, v in snapshot["rerun_seconds"].items()]
+        lines.append("# TYPE voting_rerun_round_trips summary")
+        lines += [f'voting_rerun_round_trips{{quantile="{q}"}} {v}' for q, v in snapshot["round_trips_per_rerun"].items()]
+
+        lines.append("# TYPE voting_stage_seconds summary")
+        for stage, stats in snapshot["stages"].items():
+            lines += [f'voting_stage_seconds{{stage="{stage}",quantile="{q}"}} {v:.6f}' for q, v in stats["seconds"].items()]
+            lines.append(f'voting_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+        lines.append("# TYPE voting_mongo_commands_total counter")
+        lines.append("# TYPE voting_mongo_command_seconds_total counter")
+        for name, stats in snapshot["commands"].items():
+            collection, command = name.split(".", 1)
+            labels = f'collection="{collection}",command="{command}"'
+            lines.append(f"voting_mongo_commands_total{{{labels}}} {stats['count']}")
+            lines.append(f"voting_mongo_command_seconds_total{{{labels}}} {stats['seconds']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        self.metrics.command_started(event)
+
+    def succeeded(self, event):
+        self.metrics.command_finished(event)
+
+    def failed(self, event):
+        self.metrics.command_finished(event)
+
+
+METRICS = Metrics()
+
+
+def span(stage: str):
+    return METRICS.span(stage) if ENABLED else _NO_SPAN
+
+
+def start_rerun(previous: Rerun = None):
+    return METRICS.start_rerun(previous) if ENABLED else None
+
+
+def end_rerun(rerun: Rerun = None):
+    if ENABLED and rerun is not None:
+        METRICS.commit_rerun(rerun)
+
+
+def count_vote(n: int = 1):
+    if ENABLED:
+        METRICS.count_vote(n)
+
+
+def set_thread_stage(stage: str):
+    if ENABLED:
+        METRICS.set_thread_stage(stage)
+
+
+def listeners() -> list:
+    return [CommandCounter(METRICS)] if ENABLED else []
+
+
+def start_file_dump(path: str, interval: float = 15):
+    # for the node_exporter textfile collector or anything that scrapes a file
+    def dump():
+        while True:
+            time.sleep(interval)
+            try:
+                METRICS.write_prometheus(path)
+            except OSError as e:
+                print(f"Error writing metrics to {path}: {e}")
+
+    threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
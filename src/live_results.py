@@ -0,0 +1,252 @@
+import threading
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from src import db, instrumentation, results, scoring
+from src.scoring import Scoring
+
+
+VOTE_PROJECTION = {"email": 1, "categoryId": 1, "name": 1, "vote": 1, "updated_at": 1}
+
+# "$changeStream is only supported on replica sets", the only error that switches to polling
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class Scoreboard:
+    """
+    Category counters and voter tallies of `category_votes`, kept in memory.
+
+    Every vote is remembered by its `_id`, so applying the same document twice or a changed
+    vote only moves the counters by the difference.
+    """
+
+    def __init__(self):
+        self.votes = {}       # _id -> (email, categoryId, vote)
+        self.categories = {}  # categoryId -> name and counters, same fields as category_scores
+        self.voters = {}      # email -> {vote: n, "total": n}
+        self.version = 0
+        self.listeners = []   # called with (categoryId, counters) after every change
+        self._lock = threading.Lock()
+        self._rows = (None, None, [])  # version, scoring rules, rows: every viewer shares the same sort
+        self._sorted = (None, {})      # (version, scoring rules), (sort, descending) -> rows, the other orders
+
+    def _add(self, email: str, category_id: str, vote: str, sign: int):
+        category = self.categories[category_id]
+        category["total_votes"] += sign
+        category["voters"] += sign
+        category[results.vote_field(vote)] += sign
+
+        voter = self.voters.setdefault(email, {"total": 0})
+        voter["total"] += sign
+        voter[vote] = voter.get(vote, 0) + sign
+
+    def _notify(self, category_id: str):
+        for listener in self.listeners:
+            listener(category_id, self.categories[category_id])
+
+    def apply(self, doc: dict) -> bool:
+        with self._lock:
+            previous = self.votes.get(doc["_id"])
+            current = (doc["email"], doc["categoryId"], doc["vote"])
+            if previous == current:
+                return False
+
+            category = self.categories.setdefault(doc["categoryId"], {
+                "name": doc.get("name"), "total_votes": 0, "voters": 0,
+                **{field: 0 for field in results.VOTE_FIELDS.values()}, results.BAD_VOTES_FIELD: 0,
+            })
+            category["name"] = doc.get("name", category["name"])
+
+            if previous is not None:
+                self._add(*previous, -1)
+            self._add(*current, 1)
+            self.votes[doc["_id"]] = current
+            self.version += 1
+            self._notify(doc["categoryId"])
+            return True
+
+    def remove(self, _id) -> bool:
+        with self._lock:
+            previous = self.votes.pop(_id, None)
+            if previous is None:
+                return False
+            self._add(*previous, -1)
+            self.version += 1
+            self._notify(previous[1])
+            return True
+
+    def vote_triplets(self) -> list:
+        with self._lock:
+            return list(self.votes.values())
+
+    def rows(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> list:
+        # same rows and order as results.get_scores
+        with self._lock:
+            version, rules, rows = self._rows
+            if version == self.version and rules is scoring_rules:
+                return rows
+            version = self.version
+            rows = [
+                {"categoryId": category_id, **counts, "score": scoring_rules.counts_score(counts, results.VOTE_FIELDS, results.BAD_VOTES_FIELD)}
+                for category_id, counts in self.categories.items()
+                if counts["total_votes"] > 0
+            ]
+        rows.sort(key=lambda x: (-x["score"], x["categoryId"]))
+        self._rows = (version, scoring_rules, rows)
+        return rows
+
+    def sorted_rows(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING, sort: str = "score", descending: bool = True) -> list:
+        rows = self.rows(scoring_rules)
+        if sort == "score" and descending:
+            return rows
+
+        key, orders = self._sorted
+        if key != self._rows[:2]:
+            orders = {}
+            self._sorted = (self._rows[:2], orders)
+        if (sort, descending) not in orders:
+            # by categoryId first, the sort is stable (also reversed) so ties stay in that order
+            ordered = sorted(rows, key=lambda x: x["categoryId"])
+            if sort != "categoryId":
+                ordered.sort(key=lambda x: x[sort] if x[sort] is not None else "", reverse=descending)
+            elif descending:
+                ordered.reverse()
+            orders[(sort, descending)] = ordered
+        return orders[(sort, descending)]
+
+    def query(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING, status: int = None, name: str = None,
+              min_votes: int = 0, sort: str = "score", descending: bool = True, skip: int = 0, limit: int = None) -> tuple:
+        """Page of the rows matching the filters, in the asked order, and the number of matching rows."""
+        rows = self.sorted_rows(scoring_rules, sort, descending)
+        if status is not None or name or min_votes:
+            name = name.lower() if name else None
+            rows = [
+                row for row in rows
+                if (status is None or scoring_rules.status(row["score"]) == status)
+                and (not name or name in (row["name"] or "").lower())
+                and row["total_votes"] >= min_votes
+            ]
+        return rows[skip:skip + limit if limit else None], len(rows)
+
+    def tallies(self) -> dict:
+        # same shape as results.get_voter_tallies
+        with self._lock:
+            return {
+                email: {**{vote: n for vote, n in voter.items() if n and vote != "total"}, "total": voter["total"]}
+                for email, voter in self.voters.items()
+                if voter["total"] > 0
+            }
+
+
+class LiveResults:
+    """
+    One watcher per process feeding a `Scoreboard` for every open results view.
+
+    It follows a change stream on `category_votes` (replica sets only). Without change
+    streams it polls the votes whose `updated_at` is past the last one seen, and reloads
+    everything when the number of votes no longer matches (deleted by the scripts). After
+    any error it is not ready, so the views read the database, until it has reloaded.
+    """
+
+    def __init__(self, client: MongoClient, poll_interval: float = 2, overlap: float = 5, check_every: int = 15):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.overlap = overlap  # seconds re-read before the watermark, writers' clocks are not in sync
+        self.check_every = check_every
+
+        self.scoreboard = Scoreboard()
+        self.mode = None
+        self._watermark = 0.0
+        self._stopped = threading.Event()
+        self._ready = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name="live-results", daemon=True)
+        self._thread.start()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def close(self, timeout: float = 5):
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _load(self):
+        scoreboard = Scoreboard()
+        watermark = 0.0
+        for doc in self.client[db.VOTES].find({}, VOTE_PROJECTION, batch_size=db.BATCH_SIZE):
+            scoreboard.apply(doc)
+            watermark = max(watermark, doc.get("updated_at") or 0.0)
+
+        self.scoreboard = scoreboard
+        self._watermark = watermark
+        self._ready.set()
+
+    def _run(self):
+        # its reads are not part of the cost of a vote
+        instrumentation.set_thread_stage("live_results")
+
+        # mongomock has no change streams at all, a standalone server refuses them
+        mocked = type(self.client.client).__module__.startswith("mongomock")
+        while not mocked and not self._stopped.is_set():
+            try:
+                # returns when the stream is invalidated (collection dropped or renamed), then starts over
+                self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"Change streams not available, polling the votes instead: {e}")
+                    break
+                # history lost, cursor killed, failover...: a new stream and a reload recover
+                self._stale(f"Live results stream interrupted, restarting in {self.poll_interval}s: {e}")
+            except PyMongoError as e:
+                self._stale(f"Live results stream interrupted, restarting in {self.poll_interval}s: {e}")
+            except Exception as e:
+                # a bad document or a failing listener must not end the thread, the reload starts clean
+                self._stale(f"Error in the live results, reloading in {self.poll_interval}s: {e!r}")
+
+        self._poll()
+
+    def _stale(self, message: str):
+        # the views read from the database until the scoreboard is loaded again
+        print(message)
+        self._ready.clear()
+        self._stopped.wait(self.poll_interval)
+
+    def _watch(self):
+        # the stream is opened before loading, so no vote can fall between the two
+        with self.client[db.VOTES].watch(full_document="updateLookup", max_await_time_ms=1000) as stream:
+            self.mode = "change_stream"
+            self._load()
+
+            while not self._stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+
+                if change["operationType"] == "delete":
+                    self.scoreboard.remove(change["documentKey"]["_id"])
+                elif change.get("fullDocument"):
+                    self.scoreboard.apply(change["fullDocument"])
+                elif change["operationType"] in ("drop", "rename", "invalidate"):
+                    self._load()
+
+    def _poll(self):
+        self.mode = "polling"
+        polls = 0
+        while not self._stopped.is_set():
+            try:
+                if not self._ready.is_set():
+                    self.client[db.VOTES].create_index([("updated_at", ASCENDING)])
+                    self._load()
+                elif polls % self.check_every == 0 and self.client[db.VOTES].estimated_document_count() != len(self.scoreboard.votes):
+                    self._load()
+                else:
+                    for doc in self.client[db.VOTES].find({"updated_at": {"$gte": self._watermark - self.overlap}}, VOTE_PROJECTION):
+                        self.scoreboard.apply(doc)
+                        self._watermark = max(self._watermark, doc["updated_at"])
+            except PyMongoError as e:
+                print(f"Error polling the votes: {e}")
+            except Exception as e:
+                self._stale(f"Error in the live results, reloading in {self.poll_interval}s: {e!r}")
+                continue
+            polls += 1
+            self._stopped.wait(self.poll_interval)
@@ -0,0 +1,72 @@
+from src.catalog import MacroCategory, SubCategory
+from src.progress import VoterProgress
+
+
+class Navigator:
+    """
+    The sub categories a voter still has to vote on, as seen by one rerun.
+
+    Nothing here is kept in the session: it is rebuilt from the voter's bitset and the shared
+    catalog snapshot on every rerun. The labels only walk the macro categories (one popcount
+    each), the sub category names only walk the selected one.
+    """
+
+    __slots__ = ("progress", "macro_categories", "macro_labels", "_macro_positions", "_label_positions", "_sub_names")
+
+    def __init__(self, voter_progress: VoterProgress):
+        self.progress = voter_progress
+
+        self.macro_categories = []
+        self.macro_labels = []
+        for macro_category in voter_progress.snapshot.macro_categories:
+            remaining = voter_progress.remaining_in(macro_category)
+            if remaining:
+                self.macro_categories.append(macro_category)
+                self.macro_labels.append(f"{macro_category.name} - ({remaining} sub categories)")
+
+        self._macro_positions = {c.name: i for i, c in enumerate(self.macro_categories)}
+        self._label_positions = {label: i for i, label in enumerate(self.macro_labels)}
+        self._sub_names = {}
+
+    def __len__(self) -> int:
+        return len(self.macro_categories)
+
+    def macro_index(self, name: str) -> int:
+        return self._macro_positions.get(name, 0)
+
+    def macro_index_of_label(self, label: str) -> int:
+        return self._label_positions.get(label, 0)
+
+    def macro_at(self, idx: int) -> MacroCategory:
+        return self.macro_categories[idx]
+
+    def remaining_subs(self, idx: int):
+        macro_category = self.macro_categories[idx]
+        voted = macro_category.mask(self.progress.voted_bits)
+        for i, sub_category in enumerate(macro_category.sub_categories):
+            if not voted >> i & 1:
+                yield sub_category
+
+    def sub_names(self, idx: int) -> list:
+        if idx not in self._sub_names:
+            self._sub_names[idx] = [c.name for c in self.remaining_subs(idx)]
+        return self._sub_names[idx]
+
+    def sub_category(self, idx: int, name: str) -> SubCategory:
+        sub_category = self.macro_categories[idx].positions.get(name)
+        if sub_category is None or self.progress.has_voted(sub_category.categoryId):
+            return next(self.remaining_subs(idx))
+        return sub_category
+
+    def next_after(self, idx: int, sub_category: SubCategory):
+        # after a vote the selection falls back to the first remaining sub category
+        for candidate in self.remaining_subs(idx):
+            if candidate is not sub_category:
+                return candidate
+        return None
+
+    def on_vote(self, idx: int, sub_category: SubCategory) -> bool:
+        """Mark a sub category as voted, returns True when its macro category is done."""
+        self.progress.on_vote(sub_category.categoryId)
+        self._sub_names.pop(idx, None)
+        return self.progress.remaining_in(self.macro_categories[idx]) == 0
@@ -0,0 +1,115 @@
+from pymongo import ASCENDING, MongoClient
+
+from src import db, results
+from src.catalog import Catalog
+
+
+VOTES_INDEX = [("email", ASCENDING), ("categoryId", ASCENDING)]
+
+
+def remove_duplicate_votes(client: MongoClient) -> int:
+    # keeps the latest vote of every (email, categoryId), concurrent upserts could insert two
+    duplicates = client[db.VOTES].aggregate([
+        {'$sort': {'updated_at': -1, '_id': -1}},
+        {'$group': {'_id': {'email': '$email', 'categoryId': '$categoryId'}, 'ids': {'$push': '$_id'}}},
+        {'$match': {'ids.1': {'$exists': True}}},
+    ], allowDiskUse=True)
+    stale_ids = [_id for doc in duplicates for _id in doc["ids"][1:]]
+    if stale_ids:
+        client[db.VOTES].delete_many({"_id": {"$in": stale_ids}})
+    return len(stale_ids)
+
+
+def ensure_indexes(client: MongoClient):
+    # one vote per voter and category, the index used to allow duplicates so they go first
+    for name, index in client[db.VOTES].index_information().items():
+        if index["key"] == VOTES_INDEX:
+            if index.get("unique"):
+                return
+            client[db.VOTES].drop_index(name)
+
+    removed = remove_duplicate_votes(client)
+    if removed:
+        print(f"Removed {removed} duplicate votes")
+        results.rebuild(client)
+    client[db.VOTES].create_index(VOTES_INDEX, unique=True)
+
+
+class VoterProgress:
+    """
+    What a single voter still has to do, kept in the session.
+
+    Seeded once with a single covered query on `{email, categoryId}`. The voted sub categories
+    are a bitset over the shared catalog snapshot (one bit per sub category), so a session costs
+    a few KB whatever the size of the catalog, and the counters below are popcounts.
+    """
+
+    __slots__ = ("email", "catalog", "_snapshot", "_voted", "_unknown")
+
+    def __init__(self, email: str, voted_categories_ids, catalog: Catalog):
+        self.email = email
+        self.catalog = catalog
+
+        self._snapshot = None
+        self._voted = 0
+        # votes on categories the snapshot does not know (yet), usually empty
+        self._unknown = tuple(sorted(voted_categories_ids))
+        self._sync()
+
+    @classmethod
+    def seed(cls, client: MongoClient, email: str, catalog: Catalog) -> "VoterProgress":
+        voted_categories = db.primary(client)[db.VOTES].find({"email": email}, {"categoryId": 1, "_id": 0})
+        return cls(email, {c["categoryId"] for c in voted_categories}, catalog)
+
+    @property
+    def snapshot(self):
+        self._sync()
+        return self._snapshot
+
+    @property
+    def voted_bits(self) -> int:
+        self._sync()
+        return self._voted
+
+    def _sync(self):
+        # the catalog only changes when new products show up, remap the bits on the new snapshot
+        snapshot = self.catalog.snapshot
+        if snapshot is self._snapshot:
+            return
+
+        voted_ids = list(self._unknown)
+        if self._snapshot is not None:
+            voted_ids += self._snapshot.to_ids(self._voted)
+
+        self._voted, unknown = snapshot.to_bits(voted_ids)
+        self._unknown = tuple(sorted(unknown))
+        self._snapshot = snapshot
+
+    @property
+    def n_voted(self) -> int:
+        return self.voted_bits.bit_count() + len(self._unknown)
+
+    def has_voted(self, category_id: str) -> bool:
+        sub = self.snapshot.by_id.get(category_id)
+        if sub is None:
+            return category_id in self._unknown
+        return bool(self._voted >> sub.index & 1)
+
+    def on_vote(self, category_id: str):
+        sub = self.snapshot.by_id.get(category_id)
+        if sub is None:
+            if category_id not in self._unknown:
+                self._unknown = tuple(sorted(self._unknown + (category_id,)))
+            return
+        self._voted |= 1 << sub.index
+
+    @property
+    def remaining(self) -> int:
+        return self.snapshot.size - self.voted_bits.bit_count()
+
+    def remaining_in(self, macro_category) -> int:
+        return len(macro_category) - macro_category.mask(self.voted_bits).bit_count()
+
+    @property
+    def finished(self) -> bool:
+        return self.n_voted > 0 and self.remaining == 0
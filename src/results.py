@@ -0,0 +1,196 @@
+import re
+from collections import defaultdict
+from pymongo import MongoClient, ReplaceOne
+
+from src import db, scoring
+from src.scoring import Scoring
+
+
+# every vote that is not one of these counts as "not interesting", as it always did
+VOTE_FIELDS = {
+    "interesting": "good_votes",
+    "mid interesting": "mid_votes",
+}
+BAD_VOTES_FIELD = "bad_votes"
+
+# a configured weight the counters cannot express fails at startup, not in every read
+scoring.DEFAULT_SCORING.counted_weights(VOTE_FIELDS)
+
+# columns of a results table in display order, and the ones it can be sorted by
+RESULT_COLUMNS = ["categoryId", "name", "status", "score", "total_votes", "voters", "good_votes", "mid_votes", "bad_votes"]
+SORT_FIELDS = ["score", "total_votes", "voters", "good_votes", "mid_votes", "bad_votes", "name", "categoryId"]
+
+SCORES_COLLECTION = db.SCORES
+TALLIES_COLLECTION = db.TALLIES
+
+
+def vote_field(vote: str) -> str:
+    return VOTE_FIELDS.get(vote, BAD_VOTES_FIELD)
+
+
+def delta_operations(previous_votes: dict, votes: list) -> tuple:
+    """
+    Turn a window of votes into `$inc` updates for the materialized results.
+
+    `previous_votes` maps (email, categoryId) to the vote stored before the window, missing
+    keys are first votes. Returns the (filter, update) upserts for the scores and the voter
+    tallies, plain documents so the writer can spool them.
+    """
+    category_inc = defaultdict(lambda: defaultdict(int))
+    category_names = {}
+    voter_inc = defaultdict(lambda: defaultdict(int))
+
+    for vote in votes:
+        key = (vote["email"], vote["categoryId"])
+        previous = previous_votes.get(key)
+        if previous == vote["vote"]:
+            continue
+
+        category_names[vote["categoryId"]] = vote["name"]
+        category_inc[vote["categoryId"]][vote_field(vote["vote"])] += 1
+        voter_inc[vote["email"]][f"votes.{vote['vote']}"] += 1
+
+        if previous is None:
+            category_inc[vote["categoryId"]]["total_votes"] += 1
+            category_inc[vote["categoryId"]]["voters"] += 1
+            voter_inc[vote["email"]]["total"] += 1
+        else:
+            category_inc[vote["categoryId"]][vote_field(previous)] -= 1
+            voter_inc[vote["email"]][f"votes.{previous}"] -= 1
+
+        previous_votes[key] = vote["vote"]
+
+    category_ops = [
+        ({"_id": category_id}, {"$inc": dict(inc), "$set": {"name": category_names[category_id]}})
+        for category_id, inc in category_inc.items()
+    ]
+    voter_ops = [({"_id": email}, {"$inc": dict(inc)}) for email, inc in voter_inc.items()]
+
+    return category_ops, voter_ops
+
+
+def _replace_all(collection, docs: list, previous_ids: set):
+    # in place, the vote writer keeps upserting meanwhile: a delete and insert would race it
+    # on the _id, and only documents from before the recompute can be leftovers
+    if docs:
+        collection.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False)
+    leftovers = list(previous_ids - {doc["_id"] for doc in docs})
+    if leftovers:
+        collection.delete_many({"_id": {"$in": leftovers}})
+
+
+def rebuild(client: MongoClient):
+    # full recompute from the raw votes, only needed once or after votes are deleted by hand
+    previous_scores = {doc["_id"] for doc in client[SCORES_COLLECTION].find({}, {"_id": 1})}
+    previous_tallies = {doc["_id"] for doc in client[TALLIES_COLLECTION].find({}, {"_id": 1})}
+
+    pipeline = scoring.DEFAULT_SCORING.votes_pipeline(VOTE_FIELDS, BAD_VOTES_FIELD)
+    pipeline.append({'$project': {'score': 0}})
+    category_docs = list(client[db.VOTES].aggregate(pipeline, allowDiskUse=True))
+
+    voter_docs = {}
+    for doc in client[db.VOTES].aggregate([
+        {'$group': {'_id': {'email': '$email', 'vote': '$vote'}, 'n': {'$sum': 1}}}
+    ]):
+        voter = voter_docs.setdefault(doc["_id"]["email"], {"_id": doc["_id"]["email"], "votes": {}, "total": 0})
+        voter["votes"][doc["_id"]["vote"]] = doc["n"]
+        voter["total"] += doc["n"]
+
+    _replace_all(client[SCORES_COLLECTION], category_docs, previous_scores)
+    _replace_all(client[TALLIES_COLLECTION], list(voter_docs.values()), previous_tallies)
+
+    print(f"Rebuilt results for {len(category_docs)} categories and {len(voter_docs)} voters")
+
+
+def ensure_results(client: MongoClient):
+    if client[SCORES_COLLECTION].estimated_document_count() == 0 and client[db.VOTES].estimated_document_count() > 0:
+        rebuild(client)
+
+
+def scores_pipeline(scoring_rules: Scoring = scoring.DEFAULT_SCORING, status: int = None, name: str = None,
+                    min_votes: int = 0) -> list:
+    match = {'total_votes': {'$gt': 0}}
+    if min_votes:
+        match['total_votes']['$gte'] = min_votes
+    if name:
+        match['name'] = {'$regex': re.escape(name), '$options': 'i'}
+
+    pipeline = [
+        {'$match': match},
+        {'$addFields': {'score': scoring_rules.counts_score_expression(VOTE_FIELDS, BAD_VOTES_FIELD)}},
+    ]
+    if status is not None:
+        pipeline.append({'$match': scoring_rules.status_match(status)})
+    return pipeline
+
+
+ROW_PROJECTION = {'$project': {
+    '_id': 0,
+    'categoryId': '$_id',
+    'name': 1,
+    'total_votes': 1,
+    'voters': {'$ifNull': ['$voters', '$total_votes']},
+    'good_votes': {'$ifNull': ['$good_votes', 0]},
+    'mid_votes': {'$ifNull': ['$mid_votes', 0]},
+    'bad_votes': {'$ifNull': ['$bad_votes', 0]},
+    'score': 1,
+}}
+
+
+def sort_stage(sort: str = "score", descending: bool = True) -> dict:
+    field = "_id" if sort == "categoryId" else sort
+    direction = -1 if descending else 1
+    return {field: direction} if field == "_id" else {field: direction, "_id": 1}
+
+
+def get_scores(client: MongoClient, scoring_rules: Scoring = scoring.DEFAULT_SCORING, status: int = None,
+               skip: int = 0, limit: int = None, sort: str = "score", descending: bool = True,
+               name: str = None, min_votes: int = 0) -> list:
+    pipeline = scores_pipeline(scoring_rules, status, name, min_votes) \
+        + scoring.page_stages(sort=sort_stage(sort, descending), skip=skip, limit=limit) + [ROW_PROJECTION]
+    return list(db.heavy_reads(client)[SCORES_COLLECTION].aggregate(pipeline))
+
+
+def count_scores(client: MongoClient, scoring_rules: Scoring = scoring.DEFAULT_SCORING, status: int = None,
+                 name: str = None, min_votes: int = 0) -> int:
+    pipeline = scores_pipeline(scoring_rules, status, name, min_votes) + [{'$count': 'n'}]
+    return next(iter(db.heavy_reads(client)[SCORES_COLLECTION].aggregate(pipeline)), {"n": 0})["n"]
+
+
+def iter_scores(client: MongoClient, scoring_rules: Scoring = scoring.DEFAULT_SCORING, status: int = None,
+                sort: str = "score", descending: bool = True, name: str = None, min_votes: int = 0,
+                batch_size: int = db.BATCH_SIZE):
+    # every matching row, fetched from the cursor batch by batch
+    pipeline = scores_pipeline(scoring_rules, status, name, min_votes) \
+        + scoring.page_stages(sort=sort_stage(sort, descending)) + [ROW_PROJECTION]
+    yield from db.heavy_reads(client)[SCORES_COLLECTION].aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+
+
+def with_status(rows, scoring_rules: Scoring = scoring.DEFAULT_SCORING):
+    for row in rows:
+        yield {**row, "status": scoring.STATUS_NAMES[scoring_rules.status(row["score"])]}
+
+
+def get_category_ids(client: MongoClient, status: int, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> list:
+    pipeline = scores_pipeline(scoring_rules, status) + [{'$project': {'_id': 1}}]
+    return [doc["_id"] for doc in db.heavy_reads(client)[SCORES_COLLECTION].aggregate(pipeline)]
+
+
+def get_raw_scores(client: MongoClient, scoring_rules: Scoring = scoring.DEFAULT_SCORING,
+                   skip: int = 0, limit: int = None) -> list:
+    # same rows as get_scores, recomputed from category_votes instead of the materialized counters
+    pipeline = scoring_rules.votes_pipeline(VOTE_FIELDS, BAD_VOTES_FIELD) + scoring.page_stages(skip=skip, limit=limit)
+    category_votes = list(db.heavy_reads(client)[db.VOTES].aggregate(pipeline, allowDiskUse=True))
+    for category in category_votes:
+        category["categoryId"] = category.pop("_id")
+    return category_votes
+
+
+def get_voter_tallies(client: MongoClient) -> dict:
+    user_votes = {}
+
+    for doc in db.heavy_reads(client)[TALLIES_COLLECTION].find({"total": {"$gt": 0}}, batch_size=db.BATCH_SIZE):
+        user_votes[doc["_id"]] = {vote: n for vote, n in doc.get("votes", {}).items() if n}
+        user_votes[doc["_id"]]["total"] = doc["total"]
+
+    return user_votes
@@ -0,0 +1,206 @@
+import heapq
+import math
+import threading
+
+from src import results, scoring
+from src.scoring import Scoring
+
+
+class PriorityIndex:
+    """Indexed binary max-heap: update, remove and top in O(log n), keyed by any hashable."""
+
+    def __init__(self):
+        self._heap = []       # keys
+        self._priority = {}   # key -> priority
+        self._position = {}   # key -> position in the heap
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key) -> bool:
+        return key in self._position
+
+    def priority(self, key) -> float:
+        return self._priority[key]
+
+    def _swap(self, i: int, j: int):
+        self._heap[i], self._heap[j] = self._heap[j], self._heap[i]
+        self._position[self._heap[i]] = i
+        self._position[self._heap[j]] = j
+
+    def _up(self, i: int):
+        while i > 0 and self._priority[self._heap[i]] > self._priority[self._heap[(i - 1) // 2]]:
+            self._swap(i, (i - 1) // 2)
+            i = (i - 1) // 2
+
+    def _down(self, i: int):
+        while True:
+            best = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._heap) and self._priority[self._heap[child]] > self._priority[self._heap[best]]:
+                    best = child
+            if best == i:
+                return
+            self._swap(i, best)
+            i = best
+
+    def update(self, key, priority: float):
+        if key not in self._position:
+            self._heap.append(key)
+            self._position[key] = len(self._heap) - 1
+            self._priority[key] = priority
+            self._up(len(self._heap) - 1)
+            return
+
+        old = self._priority[key]
+        self._priority[key] = priority
+        if priority > old:
+            self._up(self._position[key])
+        else:
+            self._down(self._position[key])
+
+    def remove(self, key):
+        i = self._position.pop(key, None)
+        if i is None:
+            return
+        del self._priority[key]
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._position[last] = i
+            self._up(i)
+            self._down(self._position[last])
+
+    def best_first(self):
+        # walks the heap from the top, each step costs O(log n) on the frontier
+        frontier = [(-self._priority[self._heap[0]], 0)] if self._heap else []
+        while frontier:
+            _, i = heapq.heappop(frontier)
+            yield self._heap[i]
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (-self._priority[self._heap[child]], child))
+
+
+class Scheduler:
+    """
+    Orders the sub categories by how likely more votes are to change their outcome.
+
+    With the current counts, the label of the next votes is predicted from the category's own
+    votes (plus a uniform prior). The score after the voters who did not vote yet is then roughly
+    normal, which gives the probability that the final status differs from the current one. That
+    probability is the priority. Categories under `1 - confidence` are settled and leave the
+    index. The voters are the ones of the scoreboard plus the one asking, and at least one
+    more vote is always assumed, so a category is only dropped when that cut says so. The
+    index follows the live scoreboard one category at a time, so a pick is a walk from the
+    top of the heap that only skips the categories the voter already voted.
+    """
+
+    def __init__(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING, confidence: float = 0.95,
+                 prior: float = 1.0, n_voters: int = None):
+        self.scoring_rules = scoring_rules
+        self.confidence = confidence
+        self.prior = prior
+        self.min_voters = n_voters
+
+        # weight of every counter of the scoreboard
+        self.field_weights = {field: scoring_rules.weight(vote) for vote, field in results.VOTE_FIELDS.items()}
+        self.field_weights[results.BAD_VOTES_FIELD] = scoring_rules.default_weight
+
+        self._lock = threading.Lock()
+        self._index = PriorityIndex()
+        self._snapshot = None
+        self._scoreboard = None
+        self._stale = False
+        self.n_voters = 0
+
+    def _interval(self, status: int) -> tuple:
+        if status == scoring.CONFIRMED:
+            return self.scoring_rules.confirmed, math.inf
+        if status == scoring.REJECTED:
+            return -math.inf, self.scoring_rules.rejected
+        return self.scoring_rules.rejected, self.scoring_rules.confirmed
+
+    def outcome_change(self, counts: dict) -> float:
+        """Probability that the votes still to come change the status of a category."""
+        n = sum(counts.get(field, 0) for field in self.field_weights)
+        # at least one more vote can always come, from a voter nobody counted yet
+        horizon = max(self.n_voters - n, 1)
+
+        total = n + self.prior * len(self.field_weights)
+        shares = {field: (counts.get(field, 0) + self.prior) / total for field in self.field_weights}
+        mean = sum(shares[field] * weight for field, weight in self.field_weights.items())
+        variance = sum(shares[field] * weight ** 2 for field, weight in self.field_weights.items()) - mean ** 2
+
+        score = self.scoring_rules.counts_score(counts, results.VOTE_FIELDS, results.BAD_VOTES_FIELD)
+        expected = score + horizon * mean
+        # spread of the votes themselves, plus the uncertainty on the shares
+        spread = math.sqrt(max(horizon * variance + horizon ** 2 * variance / (total + 1), 1e-12))
+
+        low, high = self._interval(self.scoring_rules.status(score))
+        cdf = lambda x: 0.5 * (1 + math.erf((x - expected) / (spread * math.sqrt(2))))  # noqa: E731
+        return 1 - (cdf(high) - cdf(low))
+
+    def priority(self, counts: dict) -> float:
+        # the change probability first, ties broken towards the categories with the fewest votes
+        n = sum(counts.get(field, 0) for field in self.field_weights)
+        return self.outcome_change(counts) + 1e-6 / (n + 1)
+
+    def _update(self, sub_index: int, counts: dict):
+        priority = self.priority(counts)
+        if priority - 1e-6 < 1 - self.confidence:
+            self._index.remove(sub_index)
+        else:
+            self._index.update(sub_index, priority)
+
+    def _on_change(self, category_id: str, counts: dict):
+        sub = self._snapshot.by_id.get(category_id)
+        if sub is None:
+            return
+        with self._lock:
+            if self._stale:
+                return
+            if len(self._scoreboard.voters) > self.n_voters:
+                # a new voter moves every horizon, the next sync starts over
+                self._stale = True
+                return
+            self._update(sub.index, counts)
+
+    def _rebuild(self, n_voters: int):
+        self.n_voters = max(self.min_voters or 0, n_voters, 1)
+        self._stale = False
+        self._index = PriorityIndex()
+        for sub in self._snapshot.sub_categories:
+            self._update(sub.index, self._scoreboard.categories.get(sub.categoryId, {}))
+
+    def sync(self, snapshot, scoreboard):
+        """Rebuild the index when the catalog or the scoreboard was replaced or a new voter showed up, otherwise a no-op."""
+        with self._lock:
+            if snapshot is self._snapshot and scoreboard is self._scoreboard and not self._stale:
+                return
+
+            self._snapshot = snapshot
+            self._scoreboard = scoreboard
+            self._rebuild(len(scoreboard.voters))
+
+        if self._on_change not in scoreboard.listeners:
+            scoreboard.listeners.append(self._on_change)
+
+    @property
+    def open_categories(self) -> int:
+        return len(self._index)
+
+    def pick(self, voter_progress):
+        """Highest priority sub category the voter did not vote yet, None when nothing is left."""
+        voted = voter_progress.voted_bits
+        with self._lock:
+            if voter_progress.snapshot is not self._snapshot:
+                return None
+            n_voters = len(self._scoreboard.voters) + (voter_progress.email not in self._scoreboard.voters)
+            if n_voters > self.n_voters:
+                # the voter asking counts in the horizon before a first vote
+                self._rebuild(n_voters)
+            for sub_index in self._index.best_first():
+                if not voted >> sub_index & 1:
+                    return self._snapshot.sub_categories[sub_index]
+        return None
@@ -0,0 +1,121 @@
+from src import db
+
+
+CONFIRMED = 1
+CONFUSED = 0
+REJECTED = -1
+
+STATUS_NAMES = {CONFIRMED: "confirmed", CONFUSED: "confused", REJECTED: "rejected"}
+
+
+class Scoring:
+    """
+    Weight table and thresholds for the category scores, compiled into aggregation stages
+    so the scores are computed by the database and only the final rows reach the app.
+
+    A category is confirmed when `score >= confirmed`, rejected when `score < rejected`
+    and confused in between. The materialized results keep a counter per vote in
+    `results.VOTE_FIELDS` and one for every other vote, so any other vote must weigh
+    `default_weight`.
+    """
+
+    def __init__(self, weights: dict = None, default_weight: float = -1, confirmed: float = 1, rejected: float = 0):
+        self.weights = {"interesting": 1, "mid interesting": 0.5} if weights is None else dict(weights)
+        self.default_weight = default_weight
+        self.confirmed = confirmed
+        self.rejected = rejected
+
+    def weight(self, vote: str) -> float:
+        return self.weights.get(vote, self.default_weight)
+
+    def status(self, score: float) -> int:
+        if score >= self.confirmed:
+            return CONFIRMED
+        if score < self.rejected:
+            return REJECTED
+        return CONFUSED
+
+    def vote_weight_expression(self, field: str = "$vote") -> dict:
+        return {"$switch": {
+            "branches": [{"case": {"$eq": [field, vote]}, "then": weight} for vote, weight in self.weights.items()],
+            "default": self.default_weight,
+        }}
+
+    def counted_weights(self, vote_fields: dict) -> list:
+        # (counter, weight) of the votes with a counter of their own, the others share the default
+        uncounted = [vote for vote, weight in self.weights.items() if vote not in vote_fields and weight != self.default_weight]
+        if uncounted:
+            raise ValueError(f"No counter for the votes {uncounted}, they can only weigh the default weight {self.default_weight}")
+        return [(vote_fields[vote], weight) for vote, weight in self.weights.items() if vote in vote_fields]
+
+    def counts_score_expression(self, vote_fields: dict, other_field: str) -> dict:
+        # score out of the materialized counters, one counter per weighted vote plus one for the rest
+        terms = [{"$multiply": [{"$ifNull": [f"${field}", 0]}, weight]} for field, weight in self.counted_weights(vote_fields)]
+        terms.append({"$multiply": [{"$ifNull": [f"${other_field}", 0]}, self.default_weight]})
+        return {"$add": terms}
+
+    def counts_score(self, counts: dict, vote_fields: dict, other_field: str) -> float:
+        # same as counts_score_expression, for counters kept in memory
+        score = sum(counts.get(field, 0) * weight for field, weight in self.counted_weights(vote_fields))
+        return score + counts.get(other_field, 0) * self.default_weight
+
+    def status_expression(self, field: str = "$score") -> dict:
+        return {"$switch": {
+            "branches": [
+                {"case": {"$gte": [field, self.confirmed]}, "then": CONFIRMED},
+                {"case": {"$lt": [field, self.rejected]}, "then": REJECTED},
+            ],
+            "default": CONFUSED,
+        }}
+
+    def status_match(self, status: int, field: str = "score") -> dict:
+        if status == CONFIRMED:
+            return {field: {"$gte": self.confirmed}}
+        if status == REJECTED:
+            return {field: {"$lt": self.rejected}}
+        return {field: {"$gte": self.rejected, "$lt": self.confirmed}}
+
+    def votes_pipeline(self, vote_fields: dict, other_field: str) -> list:
+        # straight from category_votes: counters, score and distinct voters, never the votes themselves
+        counters = {
+            field: {"$sum": {"$cond": [{"$eq": ["$vote", vote]}, 1, 0]}}
+            for vote, field in vote_fields.items()
+        }
+        counters[other_field] = {"$sum": {"$cond": [{"$in": ["$vote", list(vote_fields)]}, 0, 1]}}
+
+        return [
+            {
+                '$group': {
+                    '_id': '$categoryId',
+                    'name': {'$first': '$name'},
+                    'total_votes': {'$sum': 1},
+                    'score': {'$sum': self.vote_weight_expression()},
+                    'voters': {'$addToSet': '$email'},
+                    **counters,
+                }
+            }, {
+                '$addFields': {'voters': {'$size': '$voters'}}
+            },
+        ]
+
+
+def page_stages(sort: dict = None, skip: int = 0, limit: int = None) -> list:
+    stages = [{'$sort': sort or {'score': -1, '_id': 1}}]
+    if skip:
+        stages.append({'$skip': skip})
+    if limit:
+        stages.append({'$limit': limit})
+    return stages
+
+
+def load_scoring(path: str = db.SECRETS_FILE) -> Scoring:
+    # a [scoring] table in the secrets overrides the defaults, e.g. confirmed = 2 or
+    # weights = { interesting = 1, "mid interesting" = 0.25 }
+    try:
+        config = db.load_config(path).get("scoring", {})
+    except FileNotFoundError:
+        config = {}
+    return Scoring(**config)
+
+
+DEFAULT_SCORING = load_scoring()
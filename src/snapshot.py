@@ -0,0 +1,225 @@
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+from pymongo import ASCENDING, MongoClient
+
+from src import catalog_builder, db, results, scoring
+from src.scoring import Scoring
+
+
+MANIFEST = "manifest.json"
+VOTES_DIR = "votes"
+CATEGORIES_FILE = "categories.arrow"
+CATALOG_FILE = "catalog.arrow"
+
+# emails, category ids and vote labels repeat on every row, they are stored once per file
+VOTES_SCHEMA = pa.schema([
+    ("_id", pa.string()),
+    ("email", pa.dictionary(pa.int32(), pa.string())),
+    ("categoryId", pa.dictionary(pa.int32(), pa.string())),
+    ("vote", pa.dictionary(pa.int8(), pa.string())),
+    ("updated_at", pa.float64()),
+])
+
+CATEGORIES_SCHEMA = pa.schema([
+    ("categoryId", pa.string()),
+    ("parentCateId", pa.string()),
+    ("name", pa.string()),
+    ("confirmation_status", pa.int8()),
+])
+
+PRODUCT_TYPE = pa.struct([("id1688", pa.string()), ("image", pa.string()), ("title", pa.string()), ("sales", pa.int64())])
+CATALOG_SCHEMA = pa.schema([
+    ("macroCategoryId", pa.dictionary(pa.int32(), pa.string())),
+    ("categoryId", pa.string()),
+    ("name", pa.string()),
+    ("tot", pa.int64()),
+    ("tot_sales", pa.int64()),
+    ("products", pa.list_(PRODUCT_TYPE)),
+])
+
+
+def _write(path: str, table: pa.Table):
+    # Arrow IPC files, uncompressed so they can be memory-mapped as they are
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _read(path: str) -> pa.Table:
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_manifest(directory: str) -> dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _votes_table(docs: list) -> pa.Table:
+    return pa.table({
+        "_id": [str(doc["_id"]) for doc in docs],
+        "email": [doc["email"] for doc in docs],
+        "categoryId": [doc["categoryId"] for doc in docs],
+        "vote": [doc["vote"] for doc in docs],
+        "updated_at": [doc.get("updated_at") for doc in docs],
+    }, schema=VOTES_SCHEMA)
+
+
+def _categories_table(client: MongoClient) -> pa.Table:
+    fields = {"_id": 0, "categoryId": 1, "parentCateId": 1, "name": 1, "confirmation_status": 1}
+    docs = list(db.heavy_reads(client)[db.CATEGORIES].find({}, fields, batch_size=db.BATCH_SIZE))
+    return pa.table({field: [doc.get(field) for doc in docs] for field in CATEGORIES_SCHEMA.names}, schema=CATEGORIES_SCHEMA)
+
+
+def _catalog_table(client: MongoClient) -> pa.Table:
+    rows = [
+        {"macroCategoryId": macro["_id"], **{field: sub.get(field) for field in CATALOG_SCHEMA.names[1:]}}
+        for macro in db.heavy_reads(client)[db.CATALOG].find({}, {"updated_at": 0})
+        for sub in macro["sub_categories"]
+    ]
+    return pa.Table.from_pylist(rows, schema=CATALOG_SCHEMA)
+
+
+def export(client: MongoClient, directory: str = "snapshot", full: bool = False, overlap: float = 5, max_parts: int = 20) -> dict:
+    """
+    Export `category_votes`, `categories` and `voting_catalog` as Arrow files into `directory`.
+
+    Votes are appended: every run adds one part with the votes whose `updated_at` is past the
+    watermark of the previous run (minus `overlap` seconds), readers keep the last row per
+    (email, categoryId). The votes of the overlap are listed in the manifest, so the next
+    run skips the ones it already exported and an unchanged database adds no part. Deleted votes only disappear with `full`, which rewrites everything,
+    and the parts are compacted back into one past `max_parts`. The catalog is only exported
+    again when its version changed.
+    """
+    os.makedirs(os.path.join(directory, VOTES_DIR), exist_ok=True)
+    manifest = read_manifest(directory)
+    full = full or not manifest
+    client[db.VOTES].create_index([("updated_at", ASCENDING)])
+
+    parts = [] if full else manifest["votes"]["parts"]
+    watermark = None if full else manifest["votes"]["watermark"]
+    exported = {} if full else manifest["votes"].get("recent", {})  # _id -> updated_at, within the overlap
+
+    query = {} if watermark is None else {"updated_at": {"$gte": watermark - overlap}}
+    fields = {"email": 1, "categoryId": 1, "vote": 1, "updated_at": 1}
+    docs = [
+        doc for doc in db.heavy_reads(client)[db.VOTES].find(query, fields, batch_size=db.BATCH_SIZE)
+        if (str(doc["_id"]), doc.get("updated_at")) not in exported.items()
+    ]
+    watermark = max([doc["updated_at"] for doc in docs if doc.get("updated_at")] + [watermark or 0.0])
+    exported.update((str(doc["_id"]), doc.get("updated_at")) for doc in docs)
+    recent = {_id: updated_at for _id, updated_at in exported.items() if updated_at is not None and updated_at >= watermark - overlap}
+
+    if docs or not parts:
+        part = f"part-{int(time.time() * 1000)}.arrow"
+        _write(os.path.join(directory, VOTES_DIR, part), _votes_table(docs))
+        parts.append(part)
+
+    if len(parts) > max_parts:
+        votes = Snapshot(directory, {"votes": {"parts": parts}}).votes()
+        part = f"part-{int(time.time() * 1000)}-compacted.arrow"
+        _write(os.path.join(directory, VOTES_DIR, part), votes)
+        parts = [part]
+
+    # whatever is not listed anymore is left from a full export or a compaction
+    for name in os.listdir(os.path.join(directory, VOTES_DIR)):
+        if name not in parts:
+            os.remove(os.path.join(directory, VOTES_DIR, name))
+
+    _write(os.path.join(directory, CATEGORIES_FILE), _categories_table(client))
+
+    catalog_version = catalog_builder.get_version(client)
+    if full or catalog_version != manifest.get("catalog_version"):
+        _write(os.path.join(directory, CATALOG_FILE), _catalog_table(client))
+
+    manifest = {
+        "created_at": time.time(),
+        "votes": {"parts": parts, "watermark": watermark, "recent": recent},
+        "catalog_version": catalog_version,
+    }
+    with open(os.path.join(directory, MANIFEST + ".tmp"), "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(os.path.join(directory, MANIFEST + ".tmp"), os.path.join(directory, MANIFEST))
+
+    return {"new_votes": len(docs), "parts": len(parts), "watermark": watermark, "catalog_version": catalog_version}
+
+
+class Snapshot:
+    """
+    Read side of `export`, the files are memory-mapped so opening a snapshot costs no copy.
+
+    Answers the questions of the analysis scripts with the same shapes as the database
+    helpers (`results.get_scores`, `audit.Coverage.from_pairs`, ...).
+    """
+
+    def __init__(self, directory: str = "snapshot", manifest: dict = None):
+        self.directory = directory
+        self.manifest = manifest or read_manifest(directory)
+        if not self.manifest:
+            raise FileNotFoundError(f"No snapshot in {directory}, run scripts/snapshot.py first")
+        self._votes = None
+
+    def votes(self) -> pa.Table:
+        if self._votes is not None:
+            return self._votes
+
+        tables = [_read(os.path.join(self.directory, VOTES_DIR, part)) for part in self.manifest["votes"]["parts"]]
+        votes = pa.concat_tables(tables)
+        if len(tables) > 1:
+            # a vote changed between two exports shows up in both parts, the last one wins
+            votes = votes.unify_dictionaries().combine_chunks()
+            votes = votes.append_column("_row", pa.array(range(len(votes)), pa.int64()))
+            last = votes.group_by(["email", "categoryId"]).aggregate([("_row", "max")])
+            votes = votes.filter(pc.is_in(votes["_row"], last["_row_max"])).drop_columns(["_row"])
+
+        self._votes = votes
+        return votes
+
+    def categories(self) -> pa.Table:
+        return _read(os.path.join(self.directory, CATEGORIES_FILE))
+
+    def catalog(self) -> pa.Table:
+        return _read(os.path.join(self.directory, CATALOG_FILE))
+
+    def vote_pairs(self):
+        votes = self.votes()
+        return zip(votes["email"].to_pylist(), votes["categoryId"].to_pylist())
+
+    def with_products(self) -> set:
+        return set(self.catalog()["categoryId"].to_pylist())
+
+    def first_level(self) -> set:
+        categories = self.categories()
+        return set(categories.filter(pc.equal(categories["parentCateId"], "0"))["categoryId"].to_pylist())
+
+    def statuses(self) -> dict:
+        categories = self.categories()
+        categories = categories.filter(pc.is_valid(categories["confirmation_status"]))
+        return dict(zip(categories["categoryId"].to_pylist(), categories["confirmation_status"].to_pylist()))
+
+    def get_scores(self, scoring_rules: Scoring = scoring.DEFAULT_SCORING) -> list:
+        # same rows and order as results.get_scores, counted by (category, vote) in Arrow
+        counts = self.votes().group_by(["categoryId", "vote"]).aggregate([("email", "count")])
+        categories = self.categories()
+        names = dict(zip(categories["categoryId"].to_pylist(), categories["name"].to_pylist()))
+
+        rows = {}
+        for category_id, vote, n in zip(counts["categoryId"].to_pylist(), counts["vote"].to_pylist(), counts["email_count"].to_pylist()):
+            row = rows.setdefault(category_id, {
+                "categoryId": category_id, "name": names.get(category_id), "total_votes": 0, "voters": 0,
+                **{field: 0 for field in results.VOTE_FIELDS.values()}, results.BAD_VOTES_FIELD: 0,
+            })
+            row["total_votes"] += n
+            row["voters"] += n
+            row[results.vote_field(vote)] += n
+
+        for row in rows.values():
+            row["score"] = scoring_rules.counts_score(row, results.VOTE_FIELDS, results.BAD_VOTES_FIELD)
+        return sorted(rows.values(), key=lambda x: (-x["score"], x["categoryId"]))
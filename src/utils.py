@@ -1,219 +1,360 @@
-from time import sleep
+import os
+from itertools import islice
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 import streamlit as st
 
+from src import catalog, db, gallery, instrumentation, live_results, navigation, progress, results, scheduler, scoring, vote_writer, warmup
+
+
+GALLERY_PAGE_SIZE = 9
+LIVE_RESULTS_REFRESH = float(os.getenv("LIVE_RESULTS_REFRESH", 5))
+ADAPTIVE_CONFIDENCE = float(os.getenv("ADAPTIVE_CONFIDENCE", 0.95))
+BATCH_PAGE_SIZE = int(os.getenv("BATCH_PAGE_SIZE", 20))
+BATCH_THUMBNAILS = 3
+BATCH_CHOICES = ["skip", "interesting", "mid interesting", "not interesting"]
+RESULTS_PAGE_SIZE = int(os.getenv("RESULTS_PAGE_SIZE", 50))
+STATUS_FILTERS = {"all": None, **{name: status for status, name in scoring.STATUS_NAMES.items()}}
+
+
+def start_rerun():
+    st.session_state["rerun_metrics"] = instrumentation.start_rerun(st.session_state.get("rerun_metrics"))
+
+
+def end_rerun():
+    instrumentation.end_rerun(st.session_state.get("rerun_metrics"))
+
+
+def display_metrics():
+    if not instrumentation.ENABLED:
+        st.write("Metrics are disabled, start the app with METRICS=true")
+        return
+
+    st.write("# Metrics")
+    st.json(instrumentation.METRICS.snapshot())
+    st.write("Connection pools:")
+    st.json(db.pool_stats())
+    st.code(instrumentation.METRICS.prometheus(), language="text")
+
 
 @st.cache_resource
 def init_connection():
-    return MongoClient(st.secrets["MONGO_URL"])[st.secrets["MONGO_DB_NAME"]]
-
-
-@st.cache_data(ttl=30)
-def get_data(_client: MongoClient) -> list:
-    AGGREGATE_PRODUCTS = [
-        {
-            '$group': {
-                '_id': '$categoryId', 
-                'products': {
-                    '$push': {
-                        'id1688': '$id1688', 
-                        'image': '$imgUrl', 
-                        'title': '$title', 
-                        'sales': '$soldOut'
-                    }
-                }, 
-                'tot': {'$sum': 1}, 
-                'tot_sales': {'$sum': '$soldOut'}
-            }
-        }, {
-            '$addFields': {
-                'products': {'$slice': ['$products', 10]}
-            }
-        }, {
-            '$lookup': {
-                'from': 'categories', 
-                'localField': '_id', 
-                'foreignField': 'categoryId', 
-                'as': 'category'
-            }
-        }, {
-            '$unwind': {
-                'path': '$category', 
-                'preserveNullAndEmptyArrays': False
-            }
-        }, {
-            '$addFields': {
-                'parentCateId': '$category.parentCateId', 
-                'name': '$category.name'
-            }
-        }, {
-            '$group': {
-                '_id': '$parentCateId', 
-                'sub_categories': {'$push': '$$ROOT'}
-            }
-        }, {
-            '$lookup': {
-                'from': 'categories', 
-                'localField': '_id', 
-                'foreignField': 'categoryId', 
-                'as': 'parent'
-            }
-        }, {
-            '$unwind': {
-                'path': '$parent', 
-                'preserveNullAndEmptyArrays': False
-            }
-        }, {
-            '$addFields': {
-                'name': '$parent.name', 
-                'importance': '$parent.importance'
-            }
-        }, {
-            '$project': {'parent': 0, "sub_categories.category": 0}
-        }
-    ]
-
-    # check if already voted for this category
-    voted_categories = list(_client["category_votes"].find({"email": st.session_state["user_email"]}, {"categoryId": 1}))
-    voted_categories_ids = set(c["categoryId"] for c in voted_categories)
-    print(f"Voted categories: {voted_categories_ids}")
-
-    categories = list(_client["products_for_voting"].aggregate(AGGREGATE_PRODUCTS))
-    categories.sort(key=lambda x: len(x["sub_categories"]), reverse=True)
-
-    allowed_macro_categories = []
-
-    for category in categories:
-        # eliminate voted categories
-        category["sub_categories"] = [c for c in category["sub_categories"] if c["_id"] not in voted_categories_ids]
-
-        if "name" not in category:
-            category["name"] = "All primary categories"
-
-        if not len(category["sub_categories"]):
-            continue
-        
-        category["sub_categories"].sort(key=lambda x: x["name"])
-
-        for sub_category in category["sub_categories"]:
-            # check unique
-            sub_category["products"] = list({product["id1688"]: product for product in sub_category["products"]}.values())
-            sub_category["categoryId"] = sub_category.pop("_id")
-            for prod in sub_category["products"]:
-                if not prod.get("image"):
-                    prod["image"] = None
-
-        allowed_macro_categories.append(category)
-
-    return allowed_macro_categories
-
-
-def on_vote(mongo_client: MongoClient, vote: str, sub_category: dict, idx_selected: int):
-
-    query = {
-        "email": st.session_state["user_email"],
-        "categoryId": sub_category["categoryId"],
-    }
+    client = db.connect(st.secrets.to_dict(), event_listeners=instrumentation.listeners())
+    if instrumentation.ENABLED and os.getenv("METRICS_FILE"):
+        instrumentation.start_file_dump(os.getenv("METRICS_FILE"))
+    warmup.ensure_indexes(client)
+    results.ensure_results(client)
+    # the catalog and the live scoreboard start loading now, not on the first page that needs them
+    get_catalog(client).refresh()
+    get_live_results(client)
+    return client
 
-    if mongo_client["category_votes"].find_one(query) is None:
-        res = mongo_client["category_votes"].insert_one({
-            "email": st.session_state["user_email"],
-            "categoryId": sub_category["categoryId"],
-            "name": sub_category["name"],
-            "vote": vote,
-        })
-        if not res.acknowledged:
-            st.error("Error submitting vote!")
-            return None
-    else:
-        mongo_client["category_votes"].update_one(query, {"$set": {"vote": vote, "name": sub_category["name"]}})
 
-    ## remove te sub_category from the macro
-    new_allowd_sub_categories = [c for c in st.session_state["categories"][idx_selected]["sub_categories"] if c["name"] != sub_category["name"]]
+@st.cache_resource
+def get_catalog(_client: MongoClient) -> catalog.Catalog:
+    return catalog.Catalog(_client)
+
+
+def get_progress(client: MongoClient) -> progress.VoterProgress:
+    # the only per-voter state kept in the session: a bitset of the voted sub categories
+    voter_progress = st.session_state.get("progress")
+
+    if voter_progress is None or voter_progress.email != st.session_state["user_email"]:
+        voter_progress = progress.VoterProgress.seed(client, st.session_state["user_email"], get_catalog(client))
+        st.session_state["progress"] = voter_progress
+        print(f"Voted categories: {voter_progress.n_voted}")
 
-    st.session_state["categories"][idx_selected]["sub_categories"] = new_allowd_sub_categories
+    return voter_progress
 
-    if not len(new_allowd_sub_categories):
-        st.session_state["categories"] = [c for c in st.session_state["categories"] if c["name"] != st.session_state["macro_category_name"]]
+
+def get_data(client: MongoClient) -> list:
+    return get_navigator(client).macro_categories
+
+
+def get_navigator(client: MongoClient) -> navigation.Navigator:
+    # the catalog is shared by all the sessions, only the filter on the voted categories is per user
+    get_catalog(client).refresh()
+
+    return navigation.Navigator(get_progress(client))
+
+
+@st.cache_resource
+def get_scheduler(_client: MongoClient) -> scheduler.Scheduler:
+    return scheduler.Scheduler(confidence=ADAPTIVE_CONFIDENCE)
+
+
+def get_next_adaptive(client: MongoClient):
+    # the priorities follow the live scoreboard, shared with the results page
+    live = get_live_results(client)
+    live.wait_ready(timeout=10)
+    get_catalog(client).refresh()
+
+    voter_progress = get_progress(client)
+    adaptive_scheduler = get_scheduler(client)
+    adaptive_scheduler.sync(voter_progress.snapshot, live.scoreboard)
+    return adaptive_scheduler.pick(voter_progress)
+
+
+@st.cache_resource
+def get_vote_writer(_client: MongoClient) -> vote_writer.VoteWriter:
+    return vote_writer.VoteWriter(_client)
+
+
+def on_vote(mongo_client: MongoClient, vote: str, sub_category: catalog.SubCategory, idx_selected: int = None):
+    with instrumentation.span("on_vote"):
+        _on_vote(mongo_client, vote, sub_category, idx_selected)
+
+    st.toast("Vote submitted! 🎉")
+    st.rerun()
+
+
+def _on_vote(mongo_client: MongoClient, vote: str, sub_category: catalog.SubCategory, idx_selected: int = None):
+    instrumentation.count_vote()
+
+    # the write happens in background, the UI moves on optimistically
+    get_vote_writer(mongo_client).submit({
+        "email": st.session_state["user_email"],
+        "categoryId": sub_category.categoryId,
+        "name": sub_category.name,
+        "vote": vote,
+    })
+
+    ## mark the sub_category as voted
+    if idx_selected is None:
+        get_progress(mongo_client).on_vote(sub_category.categoryId)
+    elif get_navigator(mongo_client).on_vote(idx_selected, sub_category):
         st.session_state["macro_category_name"] = None
 
-    st.success("Vote submitted! 🎉")
-    sleep(2)
+
+def on_batch_vote(mongo_client: MongoClient, rated: list):
+    if not rated:
+        st.toast("Pick a rating for at least one sub category")
+        return
+
+    with instrumentation.span("on_batch_vote"):
+        votes = [
+            {"email": st.session_state["user_email"], "categoryId": sub_category.categoryId, "name": sub_category.name, "vote": vote}
+            for sub_category, vote in rated
+        ]
+        instrumentation.count_vote(len(votes))
+
+        # written right away with one bulk write, so every row knows whether it was saved
+        try:
+            errors = get_vote_writer(mongo_client).write_many(votes)
+        except PyMongoError as e:
+            # only the read before the write gets here, nothing was written
+            errors = dict.fromkeys(range(len(votes)), str(e))
+
+        voter_progress = get_progress(mongo_client)
+        for i, (sub_category, _) in enumerate(rated):
+            if i not in errors:
+                voter_progress.on_vote(sub_category.categoryId)
+
+        st.session_state["batch_errors"] = [f'Vote on "{rated[i][0].name}" not saved: {message}' for i, message in sorted(errors.items())]
+
+    if len(errors) < len(votes):
+        st.toast(f"{len(votes) - len(errors)} votes submitted! 🎉")
     st.rerun()
 
 
-def display_products(products: list):
+def display_batch(mongo_client: MongoClient, navigator: navigation.Navigator, idx_selected: int):
+    for message in st.session_state.pop("batch_errors", []):
+        st.error(message)
+
+    sub_categories = list(islice(navigator.remaining_subs(idx_selected), BATCH_PAGE_SIZE))
+    thumbnails = get_thumbnail_cache()
+    thumbnails.prefetch([prod.image for sub_category in sub_categories for prod in sub_category.products[:BATCH_THUMBNAILS]])
+
+    st.caption("Tab moves from one row to the next, the arrow keys change the rating, unrated rows are skipped.")
+
+    with st.form(f"batch_{navigator.macro_at(idx_selected).categoryId}"):
+        choices = {}
+        for sub_category in sub_categories:
+            col1, col2 = st.columns([2, 3])
+            choices[sub_category.categoryId] = col1.radio(
+                sub_category.name, BATCH_CHOICES, horizontal=True, key=f"batch_vote_{sub_category.categoryId}"
+            )
+            images = [thumbnails.get(prod.image, wait=False) or prod.image for prod in sub_category.products[:BATCH_THUMBNAILS] if prod.image]
+            if images:
+                col2.image(images, width=90)
+
+        submitted = st.form_submit_button(f"Submit this page ({len(sub_categories)} of {navigator.progress.remaining_in(navigator.macro_at(idx_selected))} sub categories)")
+
+    if submitted:
+        on_batch_vote(mongo_client, [(c, choices[c.categoryId]) for c in sub_categories if choices[c.categoryId] != "skip"])
+
+
+@st.cache_resource
+def get_thumbnail_cache() -> gallery.ThumbnailCache:
+    return gallery.ThumbnailCache(os.getenv("THUMBNAIL_DIR", ".thumbnails"))
+
+
+def prefetch_products(products: tuple):
+    get_thumbnail_cache().prefetch([prod.image for prod in products[:GALLERY_PAGE_SIZE]])
+
+
+def display_products(products: tuple, key: str = "gallery"):
+    thumbnails = get_thumbnail_cache()
+
+    # the gallery grows one page at a time with the "load more" button
+    shown = st.session_state.get(f"{key}_shown", GALLERY_PAGE_SIZE)
+
     row = 0
     cols = st.columns(3)
 
-    for prod in products[:9]:
+    for prod in products[:shown]:
 
         if row % 3 == 0 and row > 0:
             row = 0
             cols = st.columns(3)
 
-        prod_link = f"https://detail.1688.com/offer/{prod['id1688']}.html"
+        prod_link = f"https://detail.1688.com/offer/{prod.id1688}.html"
 
-        product_info = f"\nSales: {prod['sales']}\nTitle: {prod['title']}\n[Link to Product]({prod_link})"
+        product_info = f"\nSales: {prod.sales}\nTitle: {prod.title}\n[Link to Product]({prod_link})"
 
-        cols[row].image(prod["image"], caption=product_info, width=200) #, use_column_width=True
+        # a miss is fetched in the background, the browser loads the original meanwhile
+        image = thumbnails.get(prod.image, wait=False) or prod.image
+        if image:
+            cols[row].image(image, caption=product_info, width=200) #, use_column_width=True
+        else:
+            cols[row].markdown(product_info)
         row += 1
 
+    # warm up the next page while the user looks at this one
+    thumbnails.prefetch([prod.image for prod in products[shown:shown + GALLERY_PAGE_SIZE]])
+
+    if len(products) > shown and st.button(f"Load more ({len(products) - shown} left)", key=f"{key}_more"):
+        st.session_state[f"{key}_shown"] = shown + GALLERY_PAGE_SIZE
+        st.rerun()
 
-def get_results(client: MongoClient):
-
-    category_votes = list(client["category_votes"].aggregate([
-    {
-        '$group': {
-            '_id': '$categoryId', 
-            'name': {'$first': '$name'}, 
-            'total_votes': {'$sum': 1}, 
-            'votes': {
-                '$push': {'email': '$email', 'vote': '$vote'}
-            }
-        }
-    }, {
-        '$sort': {'total_votes': -1}
+
+def get_results(client: MongoClient, skip: int = 0, limit: int = None, **query) -> list:
+    # precomputed by the vote writer and scored by the database, one row per category
+    return results.get_scores(client, skip=skip, limit=limit, **query)
+
+
+def get_user_votes(client: MongoClient) -> dict:
+    return results.get_voter_tallies(client)
+
+
+@st.cache_resource
+def get_live_results(_client: MongoClient) -> live_results.LiveResults:
+    # one watcher for the whole server, however many results views are open
+    return live_results.LiveResults(_client)
+
+
+@st.cache_resource(max_entries=2)
+def get_analytics(_scoreboard, scoreboard_id: int, version: int) -> dict:
+    # recomputed only when the scoreboard moved, shared by every viewer
+    from src import analytics
+
+    matrix = analytics.VoteMatrix.from_scoreboard(_scoreboard)
+    agreement = matrix.agreement()
+    low, high = matrix.bootstrap()
+
+    return {
+        "fleiss_kappa": agreement["fleiss_kappa"],
+        "krippendorff_alpha": agreement["krippendorff_alpha"],
+        "voters": matrix.voter_stats(),
+        "categories": [
+            {"categoryId": category_id, "score_low": float(low[i]), "score_high": float(high[i]), **agreement["per_category"].get(category_id, {})}
+            for i, category_id in enumerate(matrix.category_ids)
+        ],
     }
-    ]))
 
-    for category in category_votes:
-        category["categoryId"] = category.pop("_id")
-        category["score"] = 0
-        category["good_votes"] = 0
-        category["mid_votes"] = 0
-        category["bad_votes"] = 0
-        category["users"] = list(set([v["email"] for v in category["votes"]]))
 
-        for vote in category["votes"]:
+def count_results(client: MongoClient, live: live_results.LiveResults, filters: dict) -> int:
+    # the number of matching rows, for the pager, without reading any page
+    if live.wait_ready(timeout=0):
+        return live.scoreboard.query(**filters, limit=1)[1]
+    return results.count_scores(client, **filters)
 
-            if vote["vote"] == "interesting":
-                category["good_votes"] += 1
-                category["score"] += 1
-            elif vote["vote"] == "mid interesting":
-                category["mid_votes"] += 1
-                category["score"] += 0.5
-            else:
-                category["bad_votes"] += 1
-                category["score"] -= 1
 
-        category["total_votes"] = len(category["votes"])
+def query_results(client: MongoClient, live: live_results.LiveResults, filters: dict, sort: str, descending: bool,
+                  skip: int, limit: int) -> list:
+    # one page, from the live scoreboard once it is loaded
+    if live.wait_ready(timeout=0):
+        return live.scoreboard.query(**filters, sort=sort, descending=descending, skip=skip, limit=limit)[0]
+    # still loading, the materialized results are close enough
+    return get_results(client, skip, limit, **filters, sort=sort, descending=descending)
 
-    category_votes.sort(key=lambda x: x["score"], reverse=True)
 
-    return category_votes
+def results_file(client: MongoClient, live: live_results.LiveResults, filters: dict, sort: str, descending: bool, file_format: str):
+    # every matching row, run by the download button only when it is clicked
+    from src import export
+
+    if live.wait_ready(timeout=0):
+        rows = live.scoreboard.query(**filters, sort=sort, descending=descending)[0]
+    else:
+        rows = results.iter_scores(client, **filters, sort=sort, descending=descending)
+    rows = results.with_status(rows)
+    return export.to_parquet(rows) if file_format == "parquet" else export.to_csv(rows)
+
+
+def display_results_table(client: MongoClient, live: live_results.LiveResults):
+    columns = st.columns([1, 2, 1, 1, 1])
+    status = columns[0].selectbox("Status", list(STATUS_FILTERS), key="results_status")
+    name = columns[1].text_input("Name contains", key="results_name")
+    min_votes = columns[2].number_input("Min votes", min_value=0, step=1, key="results_min_votes")
+    sort = columns[3].selectbox("Sort by", results.SORT_FIELDS, key="results_sort")
+    descending = columns[4].toggle("Descending", value=True, key="results_descending")
+    filters = {"status": STATUS_FILTERS[status], "name": name.strip() or None, "min_votes": int(min_votes)}
+
+    with instrumentation.span("get_results"):
+        total = count_results(client, live, filters)
+        n_pages = max(1, -(-total // RESULTS_PAGE_SIZE))
+        page = st.number_input(f"Page (of {n_pages}, {total} categories)", min_value=1, max_value=n_pages, step=1, key="results_page")
+        rows = query_results(client, live, filters, sort, descending, (page - 1) * RESULTS_PAGE_SIZE, RESULTS_PAGE_SIZE)
+
+    st.dataframe(list(results.with_status(rows)), column_order=results.RESULT_COLUMNS, hide_index=True)
+
+    columns = st.columns(2)
+    for column, file_format in zip(columns, ["csv", "parquet"]):
+        column.download_button(
+            f"Download {file_format.upper()}",
+            data=lambda file_format=file_format: results_file(client, live, filters, sort, descending, file_format),
+            file_name=f"category_results.{file_format}",
+            mime="text/csv" if file_format == "csv" else "application/vnd.apache.parquet",
+            key=f"results_download_{file_format}",
+        )
+
+
+@st.fragment(run_every=LIVE_RESULTS_REFRESH)
+def display_live_results(client: MongoClient):
+    live = get_live_results(client)
+    live.wait_ready(timeout=1)
+
+    writer = get_vote_writer(client)
+    if writer.failed:
+        st.error(f"{writer.failed} vote windows were given up on and spooled for the next start. Last: {writer.last_error}")
+
+    st.write("Here are the results by category:")
+    display_results_table(client, live)
+
+    st.write("Here are the users that already voted:")
+    with instrumentation.span("get_user_votes"):
+        user_votes = live.scoreboard.tallies() if live.wait_ready(timeout=0) else get_user_votes(client)
+    st.dataframe([{"email": email, **votes} for email, votes in user_votes.items()], hide_index=True)
+
+    # seconds of numpy on a large scoreboard, only for who asks since the fragment keeps refreshing
+    if st.toggle("Show agreement between voters", key="results_analytics") and live.wait_ready(timeout=0):
+        with st.container(border=True):
+            with instrumentation.span("get_analytics"):
+                stats = get_analytics(live.scoreboard, id(live.scoreboard), live.scoreboard.version)
+            st.write(f"Fleiss' kappa: {stats['fleiss_kappa']}, Krippendorff's alpha: {stats['krippendorff_alpha']}")
+            st.write("Leniency and bias of the voters:")
+            st.dataframe([{"email": email, **voter} for email, voter in stats["voters"].items()], hide_index=True)
+            st.write("Score intervals (95% bootstrap) and agreement by category:")
+            st.dataframe(stats["categories"], hide_index=True)
 
 
 def get_bad_categories(client: MongoClient) -> list:
-    category_votes = get_results(client)
-    return [c["categoryId"] for c in category_votes if c["score"] < 0]
+    return results.get_category_ids(client, scoring.REJECTED)
 
 
 def get_confirmed_interesting(client: MongoClient) -> list:
-    category_votes = get_results(client)
-    return [c["categoryId"] for c in category_votes if c["score"] >= 1]
+    return results.get_category_ids(client, scoring.CONFIRMED)
 
 
 def get_confused_categories(client: MongoClient) -> list:
-    category_votes = get_results(client)
-    return [c["categoryId"] for c in category_votes if 0 <= c["score"] < 1]
+    return results.get_category_ids(client, scoring.CONFUSED)
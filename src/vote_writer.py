@@ -0,0 +1,262 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from src import db, results
+
+
+class VoteWriter:
+    """
+    Write-behind queue for the votes.
+
+    `submit` only enqueues, a background thread groups the votes in small time/size windows
+    and writes each window with a single unordered `bulk_write` of idempotent upserts keyed
+    on (email, categoryId), then applies the score deltas to the materialized results.
+    Failed windows are retried with backoff, up to `max_attempts` times. What is still
+    pending at shutdown or was given up on is spooled to disk and replayed by the next
+    writer, as the stages not written yet once the votes are in, so no delta is lost or
+    applied twice.
+    """
+
+    def __init__(self, client: MongoClient, max_batch: int = 100, max_delay: float = 0.5,
+                 max_retry_delay: float = 30, max_attempts: int = 10, spool_path: str = "pending_votes.jsonl"):
+        # a vote must see the one it replaces, reads and writes stay on the primary
+        self.client = db.primary(client)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.spool_path = spool_path
+        self.failed = 0  # windows given up on since the start, shown to the admins
+        self.last_error = None
+
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Condition()
+        self._stopped = threading.Event()
+        self._in_flight = None  # (votes, stages left or None before they are prepared)
+        self._jobs = queue.Queue()  # (votes, stages left) prepared elsewhere, retried before the next window
+
+        self._replay_spool()
+
+        self._thread = threading.Thread(target=self._run, name="vote-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, vote: dict):
+        with self._pending_lock:
+            self._pending += 1
+        self._queue.put(vote)
+
+    def flush(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending_lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_lock.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10):
+        if self._stopped.is_set():
+            return
+        self.flush(timeout)
+        self._stopped.set()
+        self._thread.join(timeout)
+
+        # anything still here could not reach the database, keep it for the next start
+        jobs = [([self._queue.get_nowait()], None) for _ in range(self._queue.qsize())]
+        while not self._jobs.empty():
+            jobs.append(self._jobs.get_nowait())
+        if self._in_flight is not None:
+            jobs.append(self._in_flight)
+        if jobs:
+            self._spool(jobs)
+
+    @staticmethod
+    def to_operation(vote: dict) -> tuple:
+        # progress.VOTES_INDEX is unique, two concurrent upserts of a vote cannot both insert
+        return (
+            {"email": vote["email"], "categoryId": vote["categoryId"]},
+            # updated_at is the watermark of the live results when change streams are not available
+            {"$set": {"vote": vote["vote"], "name": vote["name"], "updated_at": time.time()}},
+        )
+
+    def previous_votes(self, keys) -> dict:
+        by_email = defaultdict(list)
+        for email, category_id in keys:
+            by_email[email].append(category_id)
+        if not by_email:
+            return {}
+
+        # one read per window to know which votes are changed rather than new
+        return {
+            (doc["email"], doc["categoryId"]): doc["vote"]
+            for doc in self.client[db.VOTES].find(
+                {"$or": [{"email": email, "categoryId": {"$in": ids}} for email, ids in by_email.items()]},
+                {"_id": 0, "email": 1, "categoryId": 1, "vote": 1},
+            )
+        }
+
+    def prepare(self, votes: list) -> list:
+        # same (email, categoryId) twice in a window: only the last vote counts
+        latest = {(v["email"], v["categoryId"]): v for v in votes}
+
+        category_ops, voter_ops = results.delta_operations(self.previous_votes(latest), list(latest.values()))
+
+        stages = [
+            (db.VOTES, [self.to_operation(v) for v in latest.values()]),
+            (results.SCORES_COLLECTION, category_ops),
+            (results.TALLIES_COLLECTION, voter_ops),
+        ]
+        return self._stages(stages)
+
+    def run_stages(self, stages: list):
+        # stages are popped once written, so a retry never applies the same score delta twice
+        while stages:
+            collection, ops = stages[0]
+            self.client[collection].bulk_write([UpdateOne(query, update, upsert=True) for query, update in ops], ordered=False)
+            stages.pop(0)
+
+    def write(self, votes: list):
+        self.run_stages(self.prepare(votes))
+
+    def write_many(self, votes: list) -> dict:
+        """
+        Synchronous write of a batch with a single bulk write, for the batch voting form.
+
+        Returns {position in `votes`: error message} for the votes the database refused, the
+        score deltas are only applied for the others. Once the votes are written nothing is
+        reported any more: score deltas that fail are retried by the background thread.
+        """
+        latest = {}
+        for i, vote in enumerate(votes):
+            latest[(vote["email"], vote["categoryId"])] = i
+        positions = list(latest.values())
+
+        previous_votes = self.previous_votes(latest)
+        vote_ops = [self.to_operation(votes[i]) for i in positions]
+        try:
+            self.run_stages([(db.VOTES, vote_ops)])
+            errors = {}
+        except BulkWriteError as e:
+            errors = {positions[error["index"]]: error.get("errmsg", "write error") for error in e.details.get("writeErrors", [])}
+        except PyMongoError as e:
+            # maybe written, maybe not: the upserts are idempotent and the deltas computed
+            # against the votes before them, so the whole batch is retried as it is
+            batch = [votes[i] for i in positions]
+            category_ops, voter_ops = results.delta_operations(previous_votes, batch)
+            self._hand_over(batch, self._stages([(db.VOTES, vote_ops), (results.SCORES_COLLECTION, category_ops), (results.TALLIES_COLLECTION, voter_ops)]), e)
+            return {}
+
+        written = [votes[i] for i in positions if i not in errors]
+        category_ops, voter_ops = results.delta_operations(previous_votes, written)
+        stages = self._stages([(results.SCORES_COLLECTION, category_ops), (results.TALLIES_COLLECTION, voter_ops)])
+        try:
+            self.run_stages(stages)
+        except Exception as e:
+            # the votes are saved, a second submit would find them and skip the deltas
+            self._hand_over(written, stages, e)
+        return errors
+
+    @staticmethod
+    def _stages(stages: list) -> list:
+        return [(collection, ops) for collection, ops in stages if ops]
+
+    def _hand_over(self, votes: list, stages: list, error: Exception):
+        print(f"Error writing {len(votes)} votes, retrying in the background: {error}")
+        with self._pending_lock:
+            self._pending += len(votes)
+        self._jobs.put((votes, stages))
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch, stages = self._jobs.get_nowait()
+            except queue.Empty:
+                batch, stages = self._next_batch(), None
+            if not batch:
+                continue
+
+            self._in_flight = (batch, stages)
+            retry_delay = 0.5
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    if stages is None:
+                        stages = self.prepare(batch)
+                        self._in_flight = (batch, stages)
+                    self.run_stages(stages)
+                    break
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        # later votes must not wait behind this window forever
+                        self.failed += 1
+                        self.last_error = f"{len(batch)} votes not written after {attempt} attempts: {e}"
+                        print(f"Giving up on {len(batch)} votes after {attempt} attempts: {e}")
+                        self._spool([self._in_flight])
+                        break
+                    print(f"Error writing {len(batch)} votes, retrying in {retry_delay}s: {e}")
+                    if self._stopped.wait(retry_delay):
+                        return
+                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+            self._in_flight = None
+
+            with self._pending_lock:
+                self._pending -= len(batch)
+                self._pending_lock.notify_all()
+
+    def _spool(self, jobs: list):
+        # a vote per line until it is prepared, then the stages it still has to write
+        n_votes = sum(len(votes) for votes, _ in jobs)
+        if not self.spool_path:
+            print(f"Lost {n_votes} pending votes, the writer has no spool file")
+            return
+        with open(self.spool_path, "a") as f:
+            for votes, stages in jobs:
+                lines = [json.dumps(vote) for vote in votes] if stages is None else [json.dumps({"votes": votes, "stages": stages})]
+                f.writelines(line + "\n" for line in lines)
+        print(f"Spooled {n_votes} pending votes to {self.spool_path}")
+
+    def _replay_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+
+        with open(self.spool_path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        os.remove(self.spool_path)
+
+        n_votes = 0
+        for line in lines:
+            if "stages" in line:
+                with self._pending_lock:
+                    self._pending += len(line["votes"])
+                self._jobs.put((line["votes"], line["stages"]))
+                n_votes += len(line["votes"])
+            else:
+                self.submit(line)
+                n_votes += 1
+        print(f"Replaying {n_votes} spooled votes")
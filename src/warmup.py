@@ -0,0 +1,65 @@
+import time
+from pymongo import ASCENDING, MongoClient
+
+from src import catalog, catalog_builder, db, progress, results
+
+
+def ensure_indexes(client: MongoClient):
+    progress.ensure_indexes(client)
+    catalog_builder.ensure_indexes(client)
+    # read by the live results poller and the snapshot export
+    client[db.VOTES].create_index([("updated_at", ASCENDING)])
+
+
+def warmup(client: MongoClient, thumbnail_cache=None, thumbnails_per_category: int = 9, max_thumbnails: int = 300) -> dict:
+    """
+    Everything the first visitor after a deploy would otherwise pay for, in order: the
+    connection, the indexes, the materialized results, the voting catalog (built when it
+    was never built) and, with a `thumbnail_cache`, the thumbnails a first render can show:
+    the first gallery page of the first sub category of every macro category, at most
+    `max_thumbnails`. They stay on disk for the app, the rest is fetched as the voters go.
+
+    Meant to run before the server takes traffic. Returns the seconds spent on every step.
+    """
+    timings = {}
+
+    def step(name: str, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings[name] = round(time.perf_counter() - start, 3)
+        return result
+
+    step("connect", client.command, "ping")
+    step("indexes", ensure_indexes, client)
+    step("results", results.ensure_results, client)
+
+    # builds the catalog first when nobody did yet
+    voting_catalog = catalog.Catalog(client)
+    step("catalog", voting_catalog.refresh, True)
+
+    thumbnails = 0
+    if thumbnail_cache is not None:
+        def fetch_thumbnails() -> int:
+            first_subs = [macro.sub_categories[0] for macro in voting_catalog.snapshot.macro_categories if macro.sub_categories]
+            images = [prod.image for sub in first_subs for prod in sub.products[:thumbnails_per_category] if prod.image]
+            futures = thumbnail_cache.prefetch(images[:max_thumbnails])
+            # every queued download, a failed one counts as not cached
+            return sum(future.result() is not None for future in futures)
+
+        thumbnails = step("thumbnails", fetch_thumbnails)
+
+    return {
+        "catalog_version": catalog_builder.get_version(client),
+        "sub_categories": voting_catalog.size,
+        "thumbnails_fetched": thumbnails,
+        "seconds": timings,
+    }
+
+
+def check(client: MongoClient) -> dict:
+    # cheap enough for a health check: the server answers and there is a catalog to vote on
+    client.command("ping")
+    version = catalog_builder.get_version(client)
+    if version is None:
+        raise RuntimeError("The voting catalog was never built, run scripts/build_catalog.py or scripts/warmup.py")
+    return {"catalog_version": version}
@@ -1,25 +1,32 @@
 import os
 from dotenv import load_dotenv
-from collections import defaultdict
 import streamlit as st
 
-from src import auth, utils
+from src import auth, db, instrumentation, results, utils
 
 load_dotenv(override=True)
 
+utils.start_rerun()
+
 # ---------------------------- AUTH CHECKS ----------------------------
-if os.getenv("DEBUG", "").lower() == "true":
-    print("Running in debug mode, skipping password check.")
-    st.session_state["password_correct"] = True
-    st.session_state["user_email"] = os.getenv("DEFAULT_EMAIL")
-    pass      # skip password check in debug mode
-
-elif not auth.check_password():
-    print("Password incorrect, stopping the script.")
-    st.stop()  # Do not continue if check_password is not True.
-
-elif not auth.check_email():
-    print("Email incorrect, stopping the script.")
+with instrumentation.span("auth"):
+    if os.getenv("DEBUG", "").lower() == "true":
+        print("Running in debug mode, skipping password check.")
+        st.session_state["password_correct"] = True
+        st.session_state["user_email"] = os.getenv("DEFAULT_EMAIL")
+        pass      # skip password check in debug mode
+
+    elif not auth.check_password():
+        print("Password incorrect, stopping the script.")
+        st.stop()  # Do not continue if check_password is not True.
+
+    elif not auth.check_email():
+        print("Email incorrect, stopping the script.")
+        st.stop()
+
+# hidden admin page with the hot path metrics
+if st.query_params.get("admin") == "metrics":
+    utils.display_metrics()
     st.stop()
 
 st.write(f"Welcome, {st.session_state['user_email']}!")
@@ -27,18 +34,22 @@ st.write(f"Welcome, {st.session_state['user_email']}!")
 
 ## ---------------------------- MONGO ----------------------------
 
-mongo_client = utils.init_connection()
-
-all_categories = utils.get_data(mongo_client)
+with instrumentation.span("init_connection"):
+    mongo_client = utils.init_connection()
 
-if "categories" not in st.session_state:
-    st.session_state["categories"] = all_categories
+# for testing, delete all votes of the test user
+if os.getenv("DEBUG", "").lower() == "true" and not st.session_state.get("already_deleted", False):
+    mongo_client[db.VOTES].delete_many({"email": st.session_state["user_email"]})
+    results.rebuild(mongo_client)
+    st.session_state["already_deleted"] = True
 
-print("Num categories", len(all_categories))
+with instrumentation.span("get_data"):
+    navigator = utils.get_navigator(mongo_client)
+    voter_progress = utils.get_progress(mongo_client)
 
 st.session_state["show_results"] = st.checkbox("Show results", False)
 
-has_finished = len(st.session_state["categories"]) == 0 and mongo_client["category_votes"].find_one({"email": st.session_state["user_email"]}) is not None
+has_finished = voter_progress.finished
 
 if st.session_state["show_results"] or has_finished:
 
@@ -46,57 +57,65 @@ if st.session_state["show_results"] or has_finished:
         if has_finished else \
     st.write("Showing results...")
 
-    category_votes = utils.get_results(mongo_client)
+    # refreshed in place every few seconds from the shared live scoreboard
+    utils.display_live_results(mongo_client)
 
-    user_votes = defaultdict(lambda: defaultdict(int))
+else:
 
-    for category in category_votes:
-        for vote in category.pop("votes"):
-            user_votes[vote["email"]][vote["vote"]] += 1
+    print(f"Collected Categories: {len(navigator)}")
 
-    for user, votes in user_votes.items():
-        user_votes[user] = dict(votes)
-        user_votes[user]["total"] = sum(votes.values())
+    # ---------------------------- Selecting Categories ----------------------------
+    st.write("# Voting App")
+    st.write(f"You still have to vote on {voter_progress.remaining} sub-categories")
 
-    st.write("Here are the users that already voted:")
-    st.write(dict(user_votes))
+    voting_mode = st.radio(
+        "Voting mode", ["One by one", "Adaptive order", "Batch"], horizontal=True, key="voting_mode",
+        help="Adaptive order: first the categories where one more vote matters most. Batch: rate a whole page of sub categories at once.",
+    )
 
-    st.write("Here are the results by category:")
-    st.write(category_votes)
+    with instrumentation.span("selectbox"):
+        if voting_mode == "Adaptive order":
+            # no choice here, the scheduler hands out the category
+            idx_selected = None
+            sub_category = utils.get_next_adaptive(mongo_client)
 
-else:
+            if sub_category is None:
+                st.write("All the categories you have left are already decided, switch off the adaptive order to vote on them anyway.")
+                utils.end_rerun()
+                st.stop()
 
-    print(f"Collected Categories: {len(st.session_state['categories'])}")
+            sub_category_name = sub_category.name
+            macro_category_name = voter_progress.snapshot.macro_by_id[sub_category.parentCateId].name
 
-    # for testing, delete all votes of the test user
-    if os.getenv("DEBUG", "").lower() == "true" and not st.session_state.get("already_deleted", False):
-        mongo_client["category_votes"].delete_many({"email": st.session_state["user_email"]})
-        st.session_state["already_deleted"] = True
+        else:
+            idx_selected = navigator.macro_index(st.session_state.get("macro_category_name", None))
 
-    # ---------------------------- Selecting Categories ----------------------------
-    st.write("# Voting App")
-    st.write(f"You still have to vote on {sum([len(c['sub_categories']) for c in st.session_state['categories']])} sub-categories")
-
-    already_selected = st.session_state.get("macro_category_name", None)
+            macro_category_label = st.selectbox("Pick a MACRO category", navigator.macro_labels, index= idx_selected)
 
-    idx_selected = 0 if not already_selected else \
-        [c["name"] for c in st.session_state["categories"]].index(already_selected)
+            if macro_category_label:
+                idx_selected = navigator.macro_index_of_label(macro_category_label)
 
-    macro_category_name = st.selectbox("Pick a MACRO category", list([f'{c["name"]} - ({len(c["sub_categories"])} sub categories)' for c in st.session_state["categories"]]), index= idx_selected)
+            macro_category = navigator.macro_at(idx_selected)
+            macro_category_name = macro_category.name
 
-    if not macro_category_name:
-        macro_category_name = st.session_state["categories"][0]["name"]
-    else:
-        macro_category_name = macro_category_name.split(" - (")[0]
+            st.session_state["macro_category_name"] = macro_category_name
 
-    macro_category = next(c for c in st.session_state["categories"] if c["name"] == macro_category_name)
+        if voting_mode == "One by one":
+            # ask to select a sub category
+            sub_category_name = st.selectbox("Pick a sub category", navigator.sub_names(idx_selected))
+            sub_category = navigator.sub_category(idx_selected, sub_category_name)
 
-    st.session_state["macro_category_name"] = macro_category["name"]
+            # after a vote the first remaining sub category is shown, get its images ready
+            next_sub_category = navigator.next_after(idx_selected, sub_category)
+            if next_sub_category is not None:
+                utils.prefetch_products(next_sub_category.products)
 
-    # ask to select a sub category
-    sub_categories = macro_category["sub_categories"]
-    sub_category_name = st.selectbox("Pick a sub category", [c["name"] for c in sub_categories])
-    sub_category = next(c for c in sub_categories if c["name"] == sub_category_name)
+    if voting_mode == "Batch":
+        # one form for a page of the macro category, one bulk write and one rerun on submit
+        with instrumentation.span("display_batch"):
+            utils.display_batch(mongo_client, navigator, idx_selected)
+        utils.end_rerun()
+        st.stop()
 
     st.markdown(f'#### <font color="red">ATTENTION:</font> How interesting is the category: {sub_category_name}?', unsafe_allow_html=True)
 
@@ -124,4 +143,8 @@ else:
     # ---------------------------- DISPLAY ----------------------------
     st.title(f'Products in "{macro_category_name}" -> "{sub_category_name}"')
 
-    utils.display_products(sub_category["products"])
+    with instrumentation.span("display_products"):
+        utils.display_products(sub_category.products, key=f'gallery_{sub_category.categoryId}')
+
+utils.end_rerun()
+